@@ -56,6 +56,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'lastmile.context_processors.base_data_processor',
+                'lastmile.context_processors.user_agreements_processor',
             ],
         },
     },
@@ -64,6 +65,30 @@ TEMPLATES = [
 WSGI_APPLICATION = 'django_lastmile.wsgi.application'
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# The default cache is shared by every worker, so a key cleared by
+#  one is cleared for all. The release phase creates its table with
+#  createcachetable. 'local' is per process, for values that never
+#  need clearing early, to save a round trip to the shared one.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'lastmile_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -88,6 +113,11 @@ AUTH_PASSWORD_VALIDATORS = [
 
 LANGUAGE_CODE = 'en-us'
 
+LANGUAGES = [
+    ('en', 'English'),
+    ('mn', 'Mongolian'),
+]
+
 TIME_ZONE = 'America/Los_Angeles'
 
 USE_I18N = True
@@ -99,6 +129,46 @@ USE_TZ = True
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+# Rows per page on the staff list views, overridable per request
+#  with ?page_size= up to the maximum
+LASTMILE_PAGE_SIZE = 50
+LASTMILE_MAX_PAGE_SIZE = 500
+
+# Seconds a rendered microsite page is served from the cache. Pages
+#  embed signed media URLs, so keep this below their expiry.
+LASTMILE_MICROSITE_CACHE_TIMEOUT = 60 * 10
+
+# Largest attachment a browser may upload straight to the bucket,
+#  and how long its signed upload policy stays valid
+LASTMILE_UPLOAD_MAX_SIZE = 200 * 1024 * 1024
+LASTMILE_UPLOAD_EXPIRES = 60 * 60
+
+# Signed media URLs are reused until this many seconds before they
+#  expire. Keep it above LASTMILE_MICROSITE_CACHE_TIMEOUT so cached
+#  pages never hold an expired link.
+LASTMILE_SIGNED_URL_MARGIN = 60 * 15
+
+# Largest attachment whose text is extracted for search when it is
+#  saved. Larger ones are left to rebuild_search_index --extract,
+#  so saves never download them within a request.
+LASTMILE_SEARCH_EXTRACT_MAX_SIZE = 10 * 1024 * 1024
+
+# Uploads are hashed as they stream in, so attachments with the
+#  same content can share one stored file
+FILE_UPLOAD_HANDLERS = [
+    'lastmile.uploadhandlers.HashingMemoryFileUploadHandler',
+    'lastmile.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
+# Where LocalPublicMediaStorage and LocalPrivateMediaStorage keep
+#  files. Select them in local_settings.py to run without S3:
+#  DEFAULT_FILE_STORAGE = \
+#      'django_lastmile.storage_backends.LocalPublicMediaStorage'
+#  PRIVATE_FILE_STORAGE = \
+#      'django_lastmile.storage_backends.LocalPrivateMediaStorage'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+
 try:
     from .local_settings import *
 except Exception as e:
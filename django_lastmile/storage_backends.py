@@ -1,26 +1,179 @@
+import hashlib
 import os
+import time
+from collections import Counter
+from urllib.parse import urlencode
 
 from django.conf import settings
+from django.core import signing
+from django.core.cache import cache, caches
+from django.core.files.storage import FileSystemStorage
+from django.core.files.storage import get_storage_class
+from django.urls import reverse
+from django.utils.functional import cached_property
 from storages.backends.s3boto3 import S3Boto3Storage
 
+# Salts of the signatures emulating S3 in LocalPrivateMediaStorage
+URL_SALT = 'django_lastmile.storage_backends.url'
+POLICY_SALT = 'django_lastmile.storage_backends.policy'
+
+
+def get_location(name, default):
+    return getattr(settings, name, os.environ.get(name, default))
+
+def private_storage():
+    """Return the storage named by PRIVATE_FILE_STORAGE, for the
+    FileFields holding private media.
+    """
+    return get_storage_class(getattr(settings, 'PRIVATE_FILE_STORAGE',
+        'django_lastmile.storage_backends.PrivateMediaStorage'))()
+
 class StaticStorage(S3Boto3Storage):
-    try:
-        location = settings.AWS_LOCATION
-    except:
-        location = os.environ['AWS_LOCATION']
+    location = get_location('AWS_LOCATION', 'static')
 
 class PublicMediaStorage(S3Boto3Storage):
-    try:
-        location = settings.AWS_PUBLIC_MEDIA_LOCATION
-    except:
-        location = os.environ['AWS_PUBLIC_MEDIA_LOCATION']
+    location = get_location('AWS_PUBLIC_MEDIA_LOCATION', 'media/public')
     file_overwrite = False
 
-class PrivateMediaStorage(S3Boto3Storage):
-    try:
-        location = settings.AWS_PRIVATE_MEDIA_LOCATION
-    except:
-        location = os.environ['AWS_PRIVATE_MEDIA_LOCATION']
+class CachedSignedURLMixin():
+    """Keeps signed URLs in the shared cache, so every worker reuses
+    one signature per object until shortly before it expires, with
+    a copy in the local cache to skip the round trip on repeats.
+    url_cache_stats counts hits and misses in this process.
+    """
+    url_cache_stats = Counter()
+
+    def url(self, name, parameters=None, expire=None,
+        http_method=None):
+        if parameters or http_method:
+            return super().url(name, parameters, expire, http_method)
+        if expire is None:
+            expire = self.querystring_expire
+        timeout = expire - settings.LASTMILE_SIGNED_URL_MARGIN
+        if timeout <= 0:
+            return super().url(name, expire=expire)
+        key = 'lastmile:signed-url:{0}:{1}'.format(expire,
+            hashlib.md5('{0}/{1}'.format(self.bucket_name,
+                self._normalize_name(self._clean_name(name)))
+                .encode()).hexdigest())
+        url = caches['local'].get(key)
+        if url is not None:
+            self.url_cache_stats['hits'] += 1
+            return url
+        cached = cache.get(key)
+        if cached is None:
+            self.url_cache_stats['misses'] += 1
+            cached = (super().url(name, expire=expire),
+                time.time() + timeout)
+            # Keep the signature of a worker that got there first
+            if not cache.add(key, cached, timeout):
+                cached = cache.get(key) or cached
+        else:
+            self.url_cache_stats['hits'] += 1
+        url, expires = cached
+        caches['local'].set(key, url, max(expires - time.time(), 0))
+        return url
+
+class PrivateMediaStorage(CachedSignedURLMixin, S3Boto3Storage):
+    location = get_location('AWS_PRIVATE_MEDIA_LOCATION',
+        'media/private')
     default_acl = 'private'
     file_overwrite = False
-    custom_domain = False
\ No newline at end of file
+    custom_domain = False
+
+    def get_presigned_post(self, name, content_type, max_size,
+        expires):
+        """Return the url and form fields of a signed POST that lets
+        a browser upload name straight to the bucket, limited to
+        content_type and max_size bytes.
+        """
+        fields = {'acl': self.default_acl, 'Content-Type': content_type}
+        conditions = [{'acl': self.default_acl},
+            {'Content-Type': content_type},
+            ['content-length-range', 1, max_size]]
+        key = self._normalize_name(self._clean_name(name))
+        return self.bucket.meta.client.generate_presigned_post(
+            self.bucket_name, key, Fields=fields,
+            Conditions=conditions, ExpiresIn=expires)
+
+class LocalPublicMediaStorage(FileSystemStorage):
+    """Stands in for PublicMediaStorage, keeping files under
+    MEDIA_ROOT/public.
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location,
+            os.path.join(settings.MEDIA_ROOT, 'public'))
+
+    @cached_property
+    def base_url(self):
+        return self._value_or_setting(self._base_url,
+            settings.MEDIA_URL + 'public/')
+
+class LocalPrivateMediaStorage(FileSystemStorage):
+    """Stands in for PrivateMediaStorage, keeping files under
+    MEDIA_ROOT/private. Signed URLs and upload policies are emulated
+    with django.core.signing and checked by lastmile's private media
+    views, so expiry and upload limits behave as on S3.
+    """
+    querystring_expire = getattr(settings, 'AWS_QUERYSTRING_EXPIRE',
+        3600)
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location,
+            os.path.join(settings.MEDIA_ROOT, 'private'))
+
+    def url(self, name, parameters=None, expire=None,
+        http_method=None):
+        if expire is None:
+            expire = self.querystring_expire
+        signature = signing.dumps({
+            'name': name,
+            'expires': time.time() + expire,
+        }, salt=URL_SALT)
+        return '{0}?{1}'.format(
+            reverse('private-media', kwargs={'name': name}),
+            urlencode({'signature': signature}))
+
+    def check_signature(self, name, signature):
+        try:
+            data = signing.loads(signature, salt=URL_SALT)
+        except signing.BadSignature:
+            return False
+        return data['name'] == name and data['expires'] > time.time()
+
+    def get_presigned_post(self, name, content_type, max_size,
+        expires):
+        policy = signing.dumps({
+            'key': name,
+            'content_type': content_type,
+            'max_size': max_size,
+            'expires': time.time() + expires,
+        }, salt=POLICY_SALT)
+        return {
+            'url': reverse('private-media-upload'),
+            'fields': {
+                'key': name,
+                'Content-Type': content_type,
+                'policy': policy,
+            },
+        }
+
+    def check_policy(self, fields, upload):
+        """Return the name to save an upload posted with fields to,
+        or None when the policy does not allow it.
+        """
+        try:
+            policy = signing.loads(fields.get('policy', ''),
+                salt=POLICY_SALT)
+        except signing.BadSignature:
+            return None
+        if fields.get('key') != policy['key'] or \
+            fields.get('Content-Type') != policy['content_type'] or \
+            not 0 < upload.size <= policy['max_size'] or \
+            policy['expires'] < time.time() or \
+            self.exists(policy['key']):
+            return None
+        return policy['key']
@@ -1,3 +1,7 @@
+import os
+
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import path, include
@@ -10,4 +14,5 @@ urlpatterns = [
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('', include('lastmile.urls')),
-]
+] + static(settings.MEDIA_URL + 'public/',
+    document_root=os.path.join(settings.MEDIA_ROOT, 'public'))
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class LastmileConfig(AppConfig):
     name = 'lastmile'
+
+    def ready(self):
+        from . import signals
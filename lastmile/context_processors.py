@@ -1,4 +1,12 @@
-from lastmile.models import Action, Actor, Commitment
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from lastmile.models import Action, Actor, Agreement, Commitment
+
+# Per-user cache of the agreements listed in the sidebar, cleared
+#  by the receivers in lastmile.signals
+USER_AGREEMENTS_KEY = 'lastmile:user-agreements:{}'
+USER_AGREEMENTS_TIMEOUT = 60 * 60
 
 
 def base_data_processor(request):
@@ -7,4 +15,25 @@ def base_data_processor(request):
         'Actor': Actor._meta,
         'Commitment': Commitment._meta,
     }
-    return context
\ No newline at end of file
+    return context
+
+def user_agreements_processor(request):
+    if not request.user.is_authenticated:
+        return {}
+    return {
+        'user_agreements': SimpleLazyObject(
+            lambda: get_user_agreements(request.user)),
+    }
+
+def get_user_agreements(user):
+    key = USER_AGREEMENTS_KEY.format(user.pk)
+    agreements = cache.get(key)
+    if agreements is None:
+        agreements = list(Agreement.objects.filter(users=user)
+            .select_related('overview'))
+        cache.set(key, agreements, USER_AGREEMENTS_TIMEOUT)
+    return agreements
+
+def clear_user_agreements(user_ids):
+    cache.delete_many([
+        USER_AGREEMENTS_KEY.format(pk) for pk in user_ids])
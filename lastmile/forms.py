@@ -0,0 +1,48 @@
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .models import Action, Attachment, Commitment
+
+
+class CSVImportForm(forms.Form):
+    file = forms.FileField(
+        help_text='A CSV file in the same format as the export')
+    dry_run = forms.BooleanField(required=False,
+        help_text='Check the file without saving anything')
+
+
+class DirectUploadForm(forms.ModelForm):
+    """Describes an attachment before its file is uploaded straight
+    to the bucket.
+    """
+    filename = forms.CharField(max_length=255)
+    content_type = forms.CharField(max_length=255, required=False)
+    size = forms.IntegerField(min_value=1)
+
+    class Meta:
+        model = Attachment
+        fields = ['name', 'description', 'commitment', 'action']
+
+    def __init__(self, *args, agreement=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['commitment'].queryset = Commitment.objects \
+            .filter(agreement=agreement)
+        self.fields['action'].queryset = Action.objects \
+            .filter(commitment__agreement=agreement)
+
+    def clean_size(self):
+        size = self.cleaned_data['size']
+        if size > settings.LASTMILE_UPLOAD_MAX_SIZE:
+            raise ValidationError(
+                'Files can be at most {} MB'.format(
+                    settings.LASTMILE_UPLOAD_MAX_SIZE // 1024 // 1024))
+        return size
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('commitment') and \
+            not cleaned_data.get('action'):
+            raise ValidationError(
+                'Attach the file to a commitment or an action')
+        return cleaned_data
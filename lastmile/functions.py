@@ -1,9 +1,66 @@
 import csv
 import datetime
+import hashlib
+import io
+import json
+import posixpath
+import time
 
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models import prefetch_related_objects
 from django.http import StreamingHttpResponse
+from PIL import Image, ImageOps
 
-from .models import Update
+from .models import Achievement, Action, Actor, Challenge
+from .models import Commitment, CommitmentCategory, Document
+from .models import Overview, Recommendation, Rendition, Update
+
+# Delay updates inserted per query by check_action_dates
+DELAY_BATCH_SIZE = 500
+# Rows validated and inserted together by import_csv
+IMPORT_CHUNK_SIZE = 500
+# Rows read from the database per round trip while exporting
+EXPORT_CHUNK_SIZE = 2000
+# Column kinds in an export column plan
+VALUE = 'value'
+FOREIGN_KEY = 'foreign_key'
+MANY_TO_MANY = 'many_to_many'
+MANY_TO_MANY_SEPARATOR = '; '
+# Schema types written by the typed CSV format, keyed by
+#  Field.get_internal_type(). Anything else is a string.
+COLUMN_TYPES = {
+    'AutoField': 'integer',
+    'BigAutoField': 'integer',
+    'IntegerField': 'integer',
+    'PositiveIntegerField': 'integer',
+    'PositiveSmallIntegerField': 'integer',
+    'SmallIntegerField': 'integer',
+    'BooleanField': 'boolean',
+    'DecimalField': 'decimal',
+    'FloatField': 'float',
+    'DateField': 'date',
+    'DateTimeField': 'datetime',
+}
+# name -> (serializer, content type, file extension)
+EXPORT_FORMATS = {}
+# When an overview's microsite last changed, part of the key of
+#  every cached microsite page
+MICROSITE_MODIFIED_KEY = 'lastmile:microsite-modified:{}'
+# Widths in pixels and formats of the renditions made of each
+#  uploaded image, as extension -> (Pillow format, content type)
+RENDITION_WIDTHS = (480, 960, 1600)
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+RENDITION_QUALITY = 80
+RENDITIONS_KEY = 'lastmile:renditions:{}'
+RENDITIONS_TIMEOUT = 60 * 10
 
 class Echo:
     """An object that implements just the write method
@@ -14,50 +71,421 @@ class Echo:
         in a buffer."""
         return value
 
-def get_export_response(Model, queryset):
-    pseudo_buffer = Echo()
-    writer = csv.writer(pseudo_buffer)
-    field_list = get_field_list(Model)
-    rows = get_rows(field_list, queryset)
-    response = StreamingHttpResponse((
-        writer.writerow(row) for row in rows),
-            content_type="text/csv")
+def export_format(name, content_type, extension):
+    """Register a serializer that turns a column plan and a stream
+    of records into a stream of strings.
+    """
+    def register(serializer):
+        EXPORT_FORMATS[name] = (serializer, content_type, extension)
+        return serializer
+    return register
+
+def get_export_response(Model, queryset, export_format='csv'):
+    serializer, content_type, extension = \
+        EXPORT_FORMATS[export_format]
+    column_plan = get_column_plan(Model)
+    records = get_records(column_plan, queryset)
+    response = StreamingHttpResponse(
+        serializer(column_plan, records),
+        content_type=content_type)
     today = datetime.date.today()
-    content_disp = 'attatchment;filename="lastmile_%s.csv"' % today
+    content_disp = 'attatchment;filename="lastmile_%s.%s"' % (
+        today, extension)
     response['Content-Disposition'] = content_disp
     return response
 
-def get_field_list(Model):
-    field_list = []
+def get_column_plan(Model):
+    """Return (name, kind, type) triples for the exported columns:
+    the model's concrete fields plus its forward many-to-many
+    fields. Reverse relations are left out since they are not part
+    of the row and would cost a query each.
+    """
+    column_plan = []
     for field in Model._meta.get_fields():
-        field_list.append(field.name)
-    return field_list
-
-def get_rows(field_list, queryset):
-    rows = [field_list,]
-    for instance in queryset:
-        rows.append(get_row(field_list, instance))
-    return rows
-
-def get_row(field_list, instance):
-    row = []
-    for field in field_list:
+        if field.auto_created and not field.concrete:
+            continue
+        if field.many_to_many:
+            column_plan.append((field.name, MANY_TO_MANY, 'list'))
+        elif field.is_relation:
+            column_plan.append((field.name, FOREIGN_KEY, 'string'))
+        elif field.concrete:
+            column_plan.append((field.name, VALUE, COLUMN_TYPES.get(
+                field.get_internal_type(), 'string')))
+    return column_plan
+
+def get_export_queryset(column_plan, queryset):
+    foreign_keys = [name for name, kind, _type in column_plan
+        if kind == FOREIGN_KEY]
+    return queryset.select_related(*foreign_keys)
+
+def get_records(column_plan, queryset,
+    chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one list of values per instance, reading the queryset
+    in chunks so memory stays bounded. Many-to-many values are
+    prefetched once per chunk and given as lists of names.
+    """
+    many_to_many = [name for name, kind, _type in column_plan
+        if kind == MANY_TO_MANY]
+    queryset = get_export_queryset(column_plan, queryset)
+    chunk = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) == chunk_size:
+            yield from get_chunk_records(
+                column_plan, chunk, many_to_many)
+            chunk = []
+    yield from get_chunk_records(column_plan, chunk, many_to_many)
+
+def get_chunk_records(column_plan, chunk, many_to_many):
+    if many_to_many:
+        prefetch_related_objects(chunk, *many_to_many)
+    for instance in chunk:
+        yield get_record(column_plan, instance)
+
+def get_record(column_plan, instance):
+    record = []
+    for name, kind, _type in column_plan:
+        value = getattr(instance, name)
+        if kind == MANY_TO_MANY:
+            value = [get_display_name(obj) for obj in value.all()]
+        elif kind == FOREIGN_KEY and value is not None:
+            value = get_display_name(value)
+        record.append(value)
+    return record
+
+def get_display_name(obj):
+    return getattr(obj, 'name', None) or str(obj)
+
+def get_csv_row(record):
+    return [MANY_TO_MANY_SEPARATOR.join(value)
+        if isinstance(value, list) else value for value in record]
+
+@export_format('csv', 'text/csv', 'csv')
+def serialize_csv(column_plan, records):
+    writer = csv.writer(Echo())
+    yield writer.writerow([column[0] for column in column_plan])
+    for record in records:
+        yield writer.writerow(get_csv_row(record))
+
+@export_format('typed-csv', 'text/csv', 'csv')
+def serialize_typed_csv(column_plan, records):
+    """CSV whose header cells carry the column type as name:type,
+    so loaders can parse values without inferring types.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(['{}:{}'.format(name, _type)
+        for name, kind, _type in column_plan])
+    for record in records:
+        yield writer.writerow(get_csv_row(record))
+
+@export_format('jsonl', 'application/x-ndjson', 'jsonl')
+def serialize_json_lines(column_plan, records):
+    names = [column[0] for column in column_plan]
+    for record in records:
+        yield json.dumps(dict(zip(names, record)),
+            cls=DjangoJSONEncoder) + '\n'
+
+class CSVImportError(Exception):
+    """Raised with the row errors of a rejected import."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(errors))
+
+class NameLookup:
+    """In-memory table of instances by name, optionally creating
+    missing instances the first time their name is seen.
+    """
+
+    def __init__(self, queryset, create=None):
+        self.verbose_name = queryset.model._meta.verbose_name
+        self.instances = {}
+        for instance in queryset:
+            self.instances.setdefault(instance.name, instance)
+        self.create = create
+
+    def get(self, name):
+        if name not in self.instances:
+            if self.create is None:
+                raise ValidationError('Unknown {0} "{1}"'.format(
+                    self.verbose_name, name))
+            self.instances[name] = self.create(name)
+        return self.instances[name]
+
+def get_import_lookups(agreement):
+    def create_category(name):
+        return CommitmentCategory.objects.create(
+            name=name, agreement=agreement)
+
+    def create_actor(name):
+        actor = Actor.objects.create(name=name)
+        actor.agreement.add(agreement)
+        return actor
+
+    return {
+        Actor: NameLookup(agreement.actor_set.all(), create_actor),
+        Commitment: NameLookup(agreement.commitment_set.all()),
+        CommitmentCategory: NameLookup(
+            agreement.commitmentcategory_set.all(), create_category),
+    }
+
+def import_csv(Model, agreement, lines,
+    chunk_size=IMPORT_CHUNK_SIZE, dry_run=False):
+    """Create Model instances in agreement from CSV lines in the
+    export format, validating and inserting chunk_size rows at a
+    time. Related objects are matched by name. The import is all or
+    nothing: CSVImportError is raised with the row errors of the
+    first invalid chunk. Returns the number of rows created.
+    """
+    reader = csv.reader(lines)
+    header = [name.split(':')[0] for name in next(reader, [])]
+    lookups = get_import_lookups(agreement)
+    column_plan = {name: kind for name, kind, _type
+        in get_column_plan(Model)}
+    columns = []
+    for i, name in enumerate(header):
+        if name not in column_plan or name in ('id', 'agreement'):
+            continue
+        field = Model._meta.get_field(name)
+        if field.is_relation and field.related_model not in lookups:
+            continue
+        columns.append((i, field, column_plan[name]))
+    created = 0
+    with transaction.atomic():
+        chunk = []
+        for row in enumerate(reader, start=2):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                created += import_chunk(
+                    Model, agreement, columns, lookups, chunk)
+                chunk = []
+        created += import_chunk(
+            Model, agreement, columns, lookups, chunk)
+        if dry_run:
+            transaction.set_rollback(True)
+    if created and not dry_run:
+        touch_agreement_microsites(agreement.pk)
+    return created
+
+def import_chunk(Model, agreement, columns, lookups, chunk):
+    errors = []
+    instances = []
+    related = []
+    for line_number, row in chunk:
         try:
-            row.append(getattr(instance, field))
-        except Exception as error:
-            row.append('')
-            print(error)
-            pass
-    return row
-
-def check_action_dates(actions):
-    iterator = 0
-    today = datetime.date.today()
-    for action in actions:
-        if action.expected_completion_date < today:
-            iterator += 1
-            print('DELAY: {}'.format(action))
-            Update.objects.add_delay(action, today)
-    return actions.count(), iterator
+            instance, many_to_many = get_import_instance(
+                Model, agreement, columns, lookups, row)
+        except ValidationError as error:
+            errors.append('Row {0}: {1}'.format(
+                line_number, ' '.join(error.messages)))
+        else:
+            instances.append(instance)
+            related.append(many_to_many)
+    if errors:
+        raise CSVImportError(errors)
+    bulk_insert(Model, instances)
+    Update.objects.bulk_create(
+        [instance.get_addition() for instance in instances])
+    links = {}
+    for instance, many_to_many in zip(instances, related):
+        for field, objs in many_to_many:
+            through = field.remote_field.through
+            links.setdefault(through, []).extend(through(**{
+                field.m2m_field_name() + '_id': instance.pk,
+                field.m2m_reverse_field_name() + '_id': obj.pk,
+            }) for obj in objs)
+    for through, rows in links.items():
+        through.objects.bulk_create(rows)
+    return len(instances)
+
+def get_import_instance(Model, agreement, columns, lookups, row):
+    instance = Model()
+    if hasattr(instance, 'agreement_id'):
+        instance.agreement = agreement
+    many_to_many = []
+    messages = []
+    for i, field, kind in columns:
+        value = row[i].strip() if i < len(row) else ''
+        try:
+            if kind == MANY_TO_MANY:
+                names = [name.strip() for name in value.split(
+                    MANY_TO_MANY_SEPARATOR.strip()) if name.strip()]
+                many_to_many.append((field, [
+                    lookups[field.related_model].get(name)
+                    for name in names]))
+            elif kind == FOREIGN_KEY:
+                setattr(instance, field.name, lookups[
+                    field.related_model].get(value)
+                    if value else None)
+            elif value == '' and field.null:
+                setattr(instance, field.attname, None)
+            elif value == '' and field.has_default():
+                setattr(instance, field.attname, field.get_default())
+            else:
+                setattr(instance, field.attname,
+                    field.clean(value, instance))
+        except ValidationError as error:
+            messages.extend('{0}: {1}'.format(field.name, message)
+                for message in error.messages)
+    if messages:
+        raise ValidationError(messages)
+    return instance, many_to_many
+
+def bulk_insert(Model, instances):
+    """bulk_create that also sets primary keys on backends which
+    cannot return them, relying on ids increasing within the
+    surrounding transaction.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Model.objects.bulk_create(instances)
+    last = Model.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    Model.objects.bulk_create(instances)
+    pks = Model.objects.filter(pk__gt=last).order_by('pk') \
+        .values_list('pk', flat=True)
+    for instance, pk in zip(instances, pks):
+        instance.pk = pk
+    return instances
+
+def get_delayed_actions(date):
+    """Return active actions past their deadline on date that do
+    not yet have a delay update recorded for that deadline.
+    """
+    recorded = Update.objects.filter(
+        action=OuterRef('pk'),
+        _type=Update.DELAY,
+        deadline=OuterRef('expected_completion_date'),
+    )
+    return Action.objects.overdue(date).filter(~Exists(recorded))
+
+def check_action_dates(date, batch_size=DELAY_BATCH_SIZE,
+    dry_run=False):
+    """Record a delay update for every newly delayed action,
+    inserting them batch_size at a time. Returns the number of
+    delays found.
+    """
+    actions = get_delayed_actions(date).only(
+        'id', 'commitment_id', 'responsible_party_id',
+        'expected_completion_date').order_by('id')
+    delays = 0
+    batch = []
+    for action in actions.iterator(chunk_size=batch_size):
+        delays += 1
+        batch.append(Update.objects.build_delay(action, date))
+        if len(batch) == batch_size:
+            if not dry_run:
+                Update.objects.bulk_create(batch)
+            batch = []
+    if batch and not dry_run:
+        Update.objects.bulk_create(batch)
+    return delays
 
+def get_microsite_modified(overview_id):
+    """Return the timestamp of the last change to an overview's
+    microsite, starting the clock if none is recorded.
+    """
+    key = MICROSITE_MODIFIED_KEY.format(overview_id)
+    cache.add(key, time.time(), None)
+    return cache.get(key)
+
+def touch_microsites(overview_ids):
+    """Mark the microsites of overview_ids as changed, so their
+    cached pages are no longer served.
+    """
+    modified = time.time()
+    cache.set_many({MICROSITE_MODIFIED_KEY.format(pk): modified
+        for pk in overview_ids if pk is not None}, None)
+
+def touch_agreement_microsites(agreement_id):
+    touch_microsites(Overview.objects.filter(
+        agreement_id=agreement_id).values_list('pk', flat=True))
+
+def get_microsite_fingerprints(overview):
+    """Return a digest per microsite page url name of the rows that
+    page renders, so a static build can skip unchanged pages.
+    """
+    def rows(queryset):
+        return list(queryset.order_by('pk').values_list())
+
+    def digest(*parts):
+        return hashlib.md5(json.dumps(parts, cls=DjangoJSONEncoder) \
+            .encode()).hexdigest()
+
+    base = [rows(Overview.objects.filter(pk=overview.pk)),
+        overview.agreement.slug]
+    return {
+        'overview-detail': digest(base,
+            rows(Achievement.objects.filter(overview=overview)),
+            rows(Challenge.objects.filter(overview=overview)),
+            rows(Recommendation.objects.filter(overview=overview))),
+        'methodology': digest(base),
+        # Commitment statuses depend on the day they are shown
+        'microsite-commitment-list': digest(base,
+            rows(Commitment.objects.filter(
+                agreement_id=overview.agreement_id)),
+            rows(CommitmentCategory.objects.filter(
+                agreement_id=overview.agreement_id)),
+            datetime.date.today()),
+        'microsite-document-list': digest(base,
+            rows(Document.objects.filter(overview=overview))),
+    }
+
+def create_renditions(field_file):
+    """Save a copy of an uploaded image in each of RENDITION_FORMATS
+    at each of RENDITION_WIDTHS, never wider than the original, and
+    record them as Renditions. Returns the Renditions, or an empty
+    list when the file is not a readable image.
+    """
+    try:
+        with field_file.storage.open(field_file.name) as original:
+            image = ImageOps.exif_transpose(Image.open(original))
+            image.load()
+    except (OSError, Image.DecompressionBombError):
+        return []
+    root = posixpath.splitext(posixpath.basename(field_file.name))[0]
+    renditions = []
+    for width in sorted({min(width, image.width)
+        for width in RENDITION_WIDTHS}):
+        resized = image.resize(
+            (width, max(1, round(image.height * width / image.width))),
+            Image.LANCZOS)
+        for extension, (image_format, content_type) \
+            in RENDITION_FORMATS.items():
+            mode = 'RGB' if image_format == 'JPEG' else 'RGBA'
+            content = io.BytesIO()
+            resized.convert(mode).save(content, image_format,
+                quality=RENDITION_QUALITY)
+            rendition = Rendition(original=field_file.name,
+                width=width, content_type=content_type)
+            rendition.file.save('{0}-{1}w.{2}'.format(
+                root, width, extension),
+                ContentFile(content.getvalue()), save=False)
+            renditions.append(rendition)
+    with transaction.atomic():
+        delete_renditions(field_file.name)
+        Rendition.objects.bulk_create(renditions)
+    cache.set(RENDITIONS_KEY.format(field_file.name), renditions,
+        RENDITIONS_TIMEOUT)
+    return renditions
+
+def delete_renditions(name):
+    """Delete the Renditions of the original file name, and their
+    files once the transaction commits.
+    """
+    renditions = list(Rendition.objects.filter(original=name))
+    Rendition.objects.filter(
+        pk__in=[rendition.pk for rendition in renditions]).delete()
+    for rendition in renditions:
+        transaction.on_commit(lambda file=rendition.file:
+            file.storage.delete(file.name))
+    cache.delete(RENDITIONS_KEY.format(name))
 
+def get_renditions(field_file):
+    """Return the Renditions of an uploaded image, by width."""
+    key = RENDITIONS_KEY.format(field_file.name)
+    renditions = cache.get(key)
+    if renditions is None:
+        renditions = list(Rendition.objects.filter(
+            original=field_file.name))
+        cache.set(key, renditions, RENDITIONS_TIMEOUT)
+    return renditions
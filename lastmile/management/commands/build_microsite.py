@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles.storage import ManifestFilesMixin
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import get_script_prefix, reverse, set_script_prefix
+from django.utils import translation
+
+from lastmile import views
+from lastmile.functions import get_microsite_fingerprints
+from lastmile.models import Overview
+
+# url name -> view rendering that microsite page
+PAGES = {
+    'overview-detail': views.OverviewDetail,
+    'methodology': views.Methodology,
+    'microsite-commitment-list': views.MicrositeCommitmentList,
+    'microsite-document-list': views.MicrositeDocumentList,
+}
+MANIFEST_NAME = 'build.json'
+
+
+class Command(BaseCommand):
+    help = 'Renders the microsite pages of each overview to static \
+        HTML under <output>/<language>/, re-rendering only pages \
+        whose data changed since the last build'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output',
+            help='Directory to write the site to')
+        parser.add_argument('--overview', type=int, action='append',
+            help='Only build this overview id (repeatable)')
+        parser.add_argument('--language', action='append',
+            help='Only build this language code (repeatable)')
+        parser.add_argument('--max-age', type=int,
+            help='Also re-render pages built more than this many '
+                'seconds ago, e.g. before their signed media URLs '
+                'expire')
+        parser.add_argument('--force', action='store_true',
+            help='Re-render every page')
+
+    def handle(self, *args, **options):
+        languages = options['language'] or \
+            [code for code, name in settings.LANGUAGES]
+        unknown = set(languages) - \
+            {code for code, name in settings.LANGUAGES}
+        if unknown:
+            raise CommandError('Unknown language {}'.format(
+                ', '.join(sorted(unknown))))
+        self.output = options['output']
+        manifest = self.load_manifest()
+        overviews = Overview.objects.filter(agreement__isnull=False) \
+            .select_related('agreement')
+        if options['overview']:
+            overviews = overviews.filter(pk__in=options['overview'])
+        start = time.perf_counter()
+        now = time.time()
+        rendered = total = 0
+        prefix = get_script_prefix()
+        try:
+            for overview in overviews:
+                fingerprints = get_microsite_fingerprints(overview)
+                for language in languages:
+                    set_script_prefix('/{}/'.format(language))
+                    for name, view_class in PAGES.items():
+                        total += 1
+                        path = reverse(name, kwargs={
+                            'agreement': overview.agreement.slug,
+                            'pk': overview.pk})
+                        built = manifest.get(path)
+                        if not options['force'] and built and \
+                            built['fingerprint'] == fingerprints[name] \
+                            and (options['max_age'] is None or
+                            now - built['time'] < options['max_age']):
+                            continue
+                        with translation.override(language):
+                            self.write_page(path, self.render(
+                                view_class, path, overview))
+                        manifest[path] = {
+                            'fingerprint': fingerprints[name],
+                            'time': now,
+                        }
+                        rendered += 1
+        finally:
+            set_script_prefix(prefix)
+            self.save_manifest(manifest)
+        assets = self.copy_assets()
+        self.stdout.write(self.style.SUCCESS(
+            'Rendered {0} of {1} pages and copied {2} assets '
+            'in {3:.2f}s'.format(rendered, total, assets,
+                time.perf_counter() - start)))
+
+    def render(self, view_class, path, overview):
+        request = RequestFactory().get(path)
+        request.user = AnonymousUser()
+        view = view_class()
+        view.setup(request, agreement=overview.agreement.slug,
+            pk=str(overview.pk))
+        # Skip the login check and the page cache, which holds
+        #  pages linked for the app rather than the static site
+        response = super(views.MicrositeCacheMixin, view).get(request)
+        return response.render().content
+
+    def write_page(self, path, content):
+        directory = os.path.join(self.output, path.lstrip('/'))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'index.html'), 'wb') as page:
+            page.write(content)
+
+    def copy_assets(self):
+        """Copy the hashed files listed in staticfiles.json that are
+        not in the build yet. Hashed names never change content, so
+        existing copies are kept.
+        """
+        if not isinstance(staticfiles_storage, ManifestFilesMixin) \
+            or not settings.STATIC_URL.startswith('/'):
+            return 0
+        copied = 0
+        directory = os.path.join(self.output,
+            settings.STATIC_URL.strip('/'))
+        for name in staticfiles_storage.hashed_files.values():
+            target = os.path.join(directory, name)
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(staticfiles_storage.path(name), target)
+            copied += 1
+        return copied
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.output, MANIFEST_NAME)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_manifest(self, manifest):
+        os.makedirs(self.output, exist_ok=True)
+        with open(os.path.join(self.output, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
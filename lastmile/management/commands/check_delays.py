@@ -1,6 +1,9 @@
-from django.core.management.base import BaseCommand
+import datetime
+import time
 
-from lastmile.functions import check_action_dates
+from django.core.management.base import BaseCommand, CommandError
+
+from lastmile.functions import DELAY_BATCH_SIZE, check_action_dates
 from lastmile.models import Action
 
 
@@ -8,19 +11,47 @@ class Command(BaseCommand):
     help = 'Checks for action items that have passed \
         their expected completion date'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--date',
+            help='Check delays as of this date (YYYY-MM-DD) '
+                'instead of today, on any day of the week')
+        parser.add_argument('--batch-size', type=int,
+            default=DELAY_BATCH_SIZE,
+            help='Delay updates to insert per query')
+        parser.add_argument('--dry-run', action='store_true',
+            help='Count delays without recording them')
+
     def handle(self, *args, **options):
-        if datetime.datetime.today().weekday() == 0:
-            actions = Action.objects.filter(
+        date = self.get_date(options['date'])
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        # Scheduled runs only check on Mondays
+        if options['date'] or date.weekday() == 0:
+            start = time.perf_counter()
+            total = Action.objects.filter(
                 status=Action.ACTIVE,
                 expected_completion_date__isnull=False
-            )
-            total, delays = check_action_dates(actions)
+            ).count()
+            delays = check_action_dates(date,
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'])
             self.stdout.write(
                 self.style.SUCCESS(
-                    'Found {0} delays from {1} action items' \
-                    .format(total, delays)
+                    '{0}Found {1} new delays from {2} action items '
+                    'in {3:.2f}s'.format(
+                        '[dry run] ' if options['dry_run'] else '',
+                        delays, total,
+                        time.perf_counter() - start)
                 )
             )
         else:
             self.stdout.write(self.style.SUCCESS(
                 'Waiting for Monday'))
+
+    def get_date(self, value):
+        if not value:
+            return datetime.date.today()
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            raise CommandError('--date must be YYYY-MM-DD')
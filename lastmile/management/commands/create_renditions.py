@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from lastmile.functions import create_renditions
+from lastmile.models import Rendition
+from lastmile.signals import IMAGE_MODELS
+
+
+class Command(BaseCommand):
+    help = 'Creates the resized renditions of uploaded overview and \
+        microsite images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+            help='Recreate renditions that already exist')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        done = set(Rendition.objects.values_list(
+            'original', flat=True))
+        created = failed = 0
+        for model in IMAGE_MODELS:
+            fields = [field.name for field in model._meta.fields
+                if isinstance(field, models.ImageField)]
+            for instance in model.objects.only(*fields):
+                for name in fields:
+                    image = getattr(instance, name)
+                    if not image or (image.name in done
+                        and not options['force']):
+                        continue
+                    if create_renditions(image):
+                        created += 1
+                    else:
+                        failed += 1
+                        self.stderr.write('Could not read {}'.format(
+                            image.name))
+                    done.add(image.name)
+        self.stdout.write(self.style.SUCCESS(
+            'Created renditions of {0} images ({1} unreadable) '
+            'in {2:.2f}s'.format(created, failed,
+                time.perf_counter() - start)))
@@ -0,0 +1,128 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from lastmile.models import Action, Agreement, Commitment
+from lastmile.models import CommitmentCategory, Update
+
+
+class Command(BaseCommand):
+    help = 'Prints query plans for the hot filter paths with and \
+        without the lastmile indexes, on a seeded dataset that is \
+        rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--actions', type=int, default=20000,
+            help='Action items to seed')
+        parser.add_argument('--agreements', type=int, default=20,
+            help='Agreements to spread the seeded data over')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            agreement = self.seed(
+                options['agreements'], options['actions'])
+            self.analyze()
+            after = self.explain_all(agreement)
+            self.drop_indexes()
+            self.analyze()
+            before = self.explain_all(agreement)
+            transaction.set_rollback(True)
+        for name in after:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, result in (('Before', before[name]),
+                ('After', after[name])):
+                plan, seconds = result
+                self.stdout.write('  {0} (best of 5: {1:.2f}ms)'.format(
+                    label, seconds * 1000))
+                for line in plan.splitlines():
+                    self.stdout.write('    ' + line)
+
+    def get_queries(self, agreement):
+        today = datetime.date.today()
+        commitment = agreement.commitment_set.first()
+        action = Action.objects.filter(
+            commitment=commitment).first()
+        return {
+            'Agreement by slug': Agreement.objects.filter(
+                slug=agreement.slug),
+            'Overdue actions': Action.objects.overdue(today),
+            'Agreement actions by status': Action.objects.filter(
+                commitment__agreement=agreement,
+                status=Action.COMPLETE),
+            'Commitment list': Commitment.objects.filter(
+                agreement=agreement,
+                category=commitment.category).order_by('order_num'),
+            'Active commitments': Commitment.objects.filter(
+                status=Commitment.ACTIVE),
+            'Action updates': Update.objects.filter(action=action),
+            'Commitment updates': Update.objects.filter(
+                commitment=commitment),
+            'Recent updates': Update.objects.all()[:20],
+        }
+
+    def explain_all(self, agreement):
+        results = {}
+        for name, queryset in self.get_queries(agreement).items():
+            timings = []
+            for i in range(5):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - start)
+            results[name] = (queryset.explain(), min(timings))
+        return results
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in (Action, Commitment, Update):
+                for index in model._meta.indexes:
+                    cursor.execute('DROP INDEX {}'.format(
+                        connection.ops.quote_name(index.name)))
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def seed(self, agreements, actions):
+        rng = random.Random(0)
+        today = datetime.date.today()
+        statuses = [status for status, label in Action.STATUS_CHOICES]
+        agreement_list = [Agreement.objects.create(
+            name='Benchmark Agreement {}'.format(i))
+            for i in range(agreements)]
+        categories = []
+        for agreement in agreement_list:
+            categories.extend(CommitmentCategory.objects.create(
+                name='Benchmark Category {}'.format(i),
+                agreement=agreement) for i in range(5))
+        Commitment.objects.bulk_create([Commitment(
+            name='Benchmark Commitment {}'.format(i),
+            agreement=category.agreement,
+            category=category,
+            status=rng.choice(statuses),
+            order_num=i,
+            expected_completion_date=today + datetime.timedelta(
+                days=rng.randint(-365, 365)),
+        ) for i, category in enumerate(categories * 10)])
+        commitments = list(Commitment.objects.filter(
+            agreement__in=agreement_list))
+        Action.objects.bulk_create([Action(
+            name='Benchmark Action {}'.format(i),
+            commitment=rng.choice(commitments),
+            status=rng.choice(statuses),
+            expected_completion_date=today + datetime.timedelta(
+                days=rng.randint(-365, 365)),
+        ) for i in range(actions)], batch_size=1000)
+        action_ids = list(Action.objects.filter(
+            commitment__in=commitments).values_list(
+            'id', 'commitment_id'))
+        Update.objects.bulk_create([Update(
+            description='Benchmark Update',
+            _type=Update.REVISION,
+            action_id=action_id,
+            commitment_id=commitment_id,
+        ) for action_id, commitment_id in action_ids * 2],
+            batch_size=1000)
+        return agreement_list[0]
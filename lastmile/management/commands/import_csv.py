@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lastmile.functions import IMPORT_CHUNK_SIZE, CSVImportError
+from lastmile.functions import import_csv
+from lastmile.models import Action, Agreement, Commitment
+
+
+class Command(BaseCommand):
+    help = 'Imports commitments or actions into an agreement \
+        from a CSV file in the export format'
+    models = {
+        'commitments': Commitment,
+        'actions': Action,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('agreement',
+            help='Slug of the agreement to import into')
+        parser.add_argument('model', choices=sorted(self.models))
+        parser.add_argument('path', help='CSV file to import')
+        parser.add_argument('--chunk-size', type=int,
+            default=IMPORT_CHUNK_SIZE,
+            help='Rows to validate and insert at a time')
+        parser.add_argument('--dry-run', action='store_true',
+            help='Validate the file without saving anything')
+
+    def handle(self, *args, **options):
+        try:
+            agreement = Agreement.objects.get(
+                slug=options['agreement'])
+        except Agreement.DoesNotExist:
+            raise CommandError('No agreement "{}"'.format(
+                options['agreement']))
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        start = time.perf_counter()
+        with open(options['path'], newline='',
+            encoding='utf-8-sig') as lines:
+            try:
+                created = import_csv(
+                    self.models[options['model']], agreement, lines,
+                    chunk_size=options['chunk_size'],
+                    dry_run=options['dry_run'])
+            except CSVImportError as error:
+                raise CommandError('\n'.join(error.errors))
+        self.stdout.write(self.style.SUCCESS(
+            '{0}Imported {1} {2} in {3:.2f}s'.format(
+                '[dry run] ' if options['dry_run'] else '',
+                created, options['model'],
+                time.perf_counter() - start)))
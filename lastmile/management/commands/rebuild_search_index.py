@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from lastmile.models import Attachment
+from lastmile.search import extract_text, get_search_backend
+from lastmile.search import get_search_columns, install_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recreates the full-text search index, and its SQLite \
+        triggers after migrations that rebuild indexed tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--extract', action='store_true',
+            help='Extract the text of attachment files again')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['extract']:
+            extracted = 0
+            for attachment in Attachment.objects.exclude(
+                file='').exclude(file=None).only('file', 'text'):
+                text = extract_text(attachment.file)
+                if text != attachment.text:
+                    Attachment.objects.filter(
+                        pk=attachment.pk).update(text=text)
+                    extracted += 1
+            self.stdout.write('Extracted the text of {} '
+                'attachments'.format(extracted))
+        install_search_index(connection, get_search_columns())
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt the {0} search index in {1:.2f}s'.format(
+                get_search_backend(connection),
+                time.perf_counter() - start)))
@@ -0,0 +1,54 @@
+# Generated by Django 3.1.13 on 2026-10-18 20:25
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def fill_slugs(apps, schema_editor):
+    """Give rows with an empty or repeated slug a free one, as
+    UniqueSlugMixin would, so the slugs can be made unique.
+    """
+    for model_name in ('Agreement', 'CommitmentCategory'):
+        model = apps.get_model('lastmile', model_name)
+        rows = list(model.objects.order_by('id').only(
+            'id', 'name', 'slug'))
+        taken = {row.slug for row in rows}
+        seen = set()
+        for row in rows:
+            if row.slug and row.slug not in seen:
+                seen.add(row.slug)
+                continue
+            base = slugify(row.name) or model._meta.model_name
+            slug = base
+            iterator = 2
+            while slug in taken:
+                slug = base + str(iterator)
+                iterator += 1
+            taken.add(slug)
+            seen.add(slug)
+            row.slug = slug
+            row.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+    # Commit the new slugs before the unique indexes are built
+    atomic = False
+
+    dependencies = [
+        ('lastmile', '0024_auto_20200818_1522'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_slugs, migrations.RunPython.noop,
+            atomic=True),
+        migrations.AlterField(
+            model_name='agreement',
+            name='slug',
+            field=models.SlugField(blank=True, max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='commitmentcategory',
+            name='slug',
+            field=models.SlugField(blank=True, max_length=255, unique=True),
+        ),
+    ]
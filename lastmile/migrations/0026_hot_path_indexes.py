@@ -0,0 +1,45 @@
+# Generated by Django 3.1.13 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastmile', '0025_unique_slugs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(fields=['status', 'expected_completion_date'], name='action_status_expected'),
+        ),
+        migrations.AddIndex(
+            model_name='action',
+            index=models.Index(condition=models.Q(status='active'), fields=['expected_completion_date'], name='action_active_expected'),
+        ),
+        migrations.AddIndex(
+            model_name='commitment',
+            index=models.Index(fields=['agreement', 'category', 'order_num'], name='commitment_agreement_order'),
+        ),
+        migrations.AddIndex(
+            model_name='commitment',
+            index=models.Index(fields=['status'], name='commitment_status'),
+        ),
+        migrations.AddIndex(
+            model_name='commitment',
+            index=models.Index(condition=models.Q(status='active'), fields=['expected_completion_date'], name='commitment_active_expected'),
+        ),
+        migrations.AddIndex(
+            model_name='update',
+            index=models.Index(fields=['commitment', '-date_created'], name='update_commitment_created'),
+        ),
+        migrations.AddIndex(
+            model_name='update',
+            index=models.Index(fields=['action', '-date_created'], name='update_action_created'),
+        ),
+        migrations.AddIndex(
+            model_name='update',
+            index=models.Index(fields=['-date_created'], name='update_created'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.13 on 2026-10-18 20:37
+
+from django.db import migrations, models
+import django_lastmile.storage_backends
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastmile', '0026_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original', models.CharField(db_index=True, max_length=255)),
+                ('file', models.ImageField(max_length=255, storage=django_lastmile.storage_backends.PrivateMediaStorage(), upload_to='renditions/')),
+                ('width', models.PositiveIntegerField()),
+                ('content_type', models.CharField(max_length=50)),
+            ],
+            options={
+                'ordering': ('width',),
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.1.13 on 2026-10-18 20:40
+
+from django.db import migrations, models
+import django_lastmile.storage_backends
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastmile', '0027_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='achievement',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='files/'),
+        ),
+        migrations.AlterField(
+            model_name='challenge',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='document',
+            field=models.FileField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='docs/'),
+        ),
+        migrations.AlterField(
+            model_name='overview',
+            name='commitments_image',
+            field=models.ImageField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='overview',
+            name='hero_image',
+            field=models.ImageField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='overview',
+            name='story_image',
+            field=models.ImageField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='recommendation',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='rendition',
+            name='file',
+            field=models.ImageField(max_length=255, storage=django_lastmile.storage_backends.private_storage, upload_to='renditions/'),
+        ),
+    ]
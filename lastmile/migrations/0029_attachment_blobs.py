@@ -0,0 +1,30 @@
+# Generated by Django 3.1.13 on 2026-10-18 20:42
+
+from django.db import migrations, models
+import django_lastmile.storage_backends
+import lastmile.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastmile', '0028_private_storage_setting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=lastmile.models.BlobFileField(blank=True, null=True, storage=django_lastmile.storage_backends.private_storage, upload_to='files/'),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 3.1.13 on 2026-10-18 20:47
+
+from django.db import migrations, models
+
+# Columns indexed as of this migration, the first weighted above
+#  the others
+SEARCH_COLUMNS = {
+    'lastmile_commitment': ('name', 'description',
+        'status_description'),
+    'lastmile_action': ('name', 'description'),
+    'lastmile_update': ('description',),
+    'lastmile_attachment': ('name', 'description', 'text'),
+}
+TRIGGER_EVENTS = ('insert', 'delete', 'update')
+
+
+def get_postgresql_statements(qn, table, columns):
+    values = ["coalesce({}, '')".format(qn(column))
+        for column in columns]
+    weighted = "setweight(to_tsvector('simple'::regconfig, {0}), " \
+        "'{1}')"
+    vector = weighted.format(values[0], 'A')
+    if len(values) > 1:
+        vector += ' || ' + weighted.format(
+            " || ' ' || ".join(values[1:]), 'B')
+    return ['CREATE INDEX IF NOT EXISTS {0} ON {1} '
+        'USING gin (({2}))'.format(qn(table + '_search'), qn(table),
+            vector)]
+
+def get_sqlite_statements(qn, table, columns):
+    index = qn(table + '_search')
+    names = ', '.join(qn(column) for column in columns)
+    new = ', '.join('new.' + qn(column) for column in columns)
+    old = ', '.join('old.' + qn(column) for column in columns)
+    insert = 'INSERT INTO {0}(rowid, {1}) VALUES ' \
+        '(new.id, {2});'.format(index, names, new)
+    delete = "INSERT INTO {0}({0}, rowid, {1}) VALUES " \
+        "('delete', old.id, {2});".format(index, names, old)
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING "
+        "fts5({1}, content='{2}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')".format(
+            index, names, table),
+        'CREATE TRIGGER IF NOT EXISTS {0} AFTER INSERT ON {1} '
+        'BEGIN {2} END'.format(qn(table + '_search_insert'),
+            qn(table), insert),
+        'CREATE TRIGGER IF NOT EXISTS {0} AFTER DELETE ON {1} '
+        'BEGIN {2} END'.format(qn(table + '_search_delete'),
+            qn(table), delete),
+        'CREATE TRIGGER IF NOT EXISTS {0} AFTER UPDATE OF {1} '
+        'ON {2} BEGIN {3} {4} END'.format(
+            qn(table + '_search_update'), names, qn(table),
+            delete, insert),
+        "INSERT INTO {0}({0}) VALUES ('rebuild')".format(index),
+    ]
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    if connection.vendor == 'postgresql':
+        get_statements = get_postgresql_statements
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                return
+        get_statements = get_sqlite_statements
+    else:
+        return
+    for table, columns in SEARCH_COLUMNS.items():
+        for statement in get_statements(qn, table, columns):
+            schema_editor.execute(statement)
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    for table in SEARCH_COLUMNS:
+        if connection.vendor == 'postgresql':
+            schema_editor.execute('DROP INDEX IF EXISTS {}'.format(
+                qn(table + '_search')))
+        elif connection.vendor == 'sqlite':
+            for event in TRIGGER_EVENTS:
+                schema_editor.execute(
+                    'DROP TRIGGER IF EXISTS {}'.format(
+                        qn('{0}_search_{1}'.format(table, event))))
+            schema_editor.execute('DROP TABLE IF EXISTS {}'.format(
+                qn(table + '_search')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastmile', '0029_attachment_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='text',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
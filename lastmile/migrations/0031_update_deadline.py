@@ -0,0 +1,39 @@
+# Generated by Django 3.1.13 on 2026-10-18 20:55
+
+import datetime
+import re
+
+from django.db import migrations, models
+
+# Delay descriptions end with the deadline they were recorded for
+DEADLINE_PATTERN = re.compile(r' - (\d{4}-\d{2}-\d{2})$')
+
+
+def set_delay_deadlines(apps, schema_editor):
+    Update = apps.get_model('lastmile', 'Update')
+    updates = []
+    for update in Update.objects.filter(_type='delay',
+        deadline=None).only('id', 'description').iterator():
+        match = DEADLINE_PATTERN.search(update.description)
+        if match:
+            update.deadline = datetime.date.fromisoformat(
+                match.group(1))
+            updates.append(update)
+    Update.objects.bulk_update(updates, ['deadline'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lastmile', '0030_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='update',
+            name='deadline',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_delay_deadlines,
+            migrations.RunPython.noop),
+    ]
@@ -1,27 +1,277 @@
 import csv
 import datetime
+import hashlib
+import posixpath
 
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, CharField, Count, IntegerField
+from django.db.models import F, OuterRef, Q, Subquery, Value, When
+from django.db.models.fields.files import FieldFile
+from django.db.models.functions import Coalesce
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.text import slugify
 from django_lastmile import storage_backends
 
-class Agreement(models.Model):
+def is_listed(field, field_names):
+    """Return whether field is in field_names, by name or attname,
+    with None listing every field.
+    """
+    return field_names is None or field.name in field_names \
+        or field.attname in field_names
+
+class TrackedFieldsMixin():
+    """Remembers the concrete field values an instance was loaded
+    with, so a save can be diffed without reading the row again.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.take_snapshot(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self.take_snapshot(fields)
+
+    def take_snapshot(self, field_names=None):
+        """Record the current values of the loaded concrete fields,
+        or only of field_names, as the ones in the database.
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred or not is_listed(
+                field, field_names):
+                continue
+            value = getattr(self, field.attname)
+            # FieldFile.save renames the file in place
+            if isinstance(value, FieldFile):
+                value = value.name
+            loaded[field.attname] = value
+        self._loaded_values = loaded
+
+    def get_changes(self, *field_names, update_fields=None):
+        """Yield (field, old, new) for each loaded concrete field
+        whose value differs from the snapshot, optionally limited
+        to field_names and to the update_fields of a save. Related
+        objects are only fetched for foreign keys that changed.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if not loaded:
+            return
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in loaded:
+                continue
+            if field_names and field.name not in field_names:
+                continue
+            if not is_listed(field, update_fields):
+                continue
+            old = loaded[field.attname]
+            new = getattr(self, field.attname)
+            if new == old:
+                continue
+            if field.is_relation:
+                if old is not None:
+                    old = field.related_model._base_manager \
+                        .filter(pk=old).first()
+                new = getattr(self, field.name)
+            yield field, old, new
+
+    def get_revisions(self, update_fields=None):
+        """Return the unsaved Update rows describing get_changes().
+        """
+        return []
+
+    @classmethod
+    def bulk_apply_changes(cls, queryset, **fields):
+        """Set fields on every row of queryset with one UPDATE and
+        record the revisions each save() would have, in one
+        bulk_create. Returns the number of rows updated.
+        """
+        if not fields:
+            return 0
+        for name in fields:
+            if not cls._meta.get_field(name).concrete:
+                raise ValueError(
+                    '{} is not a concrete field'.format(name))
+        with transaction.atomic():
+            instances = list(cls._default_manager.filter(
+                pk__in=queryset.values('pk')).select_for_update())
+            revisions = []
+            for instance in instances:
+                for name, value in fields.items():
+                    setattr(instance, name, value)
+                revisions.extend(instance.get_revisions())
+            count = cls._default_manager.filter(
+                pk__in=[instance.pk for instance in instances]) \
+                .update(**fields)
+            Update.objects.bulk_create(revisions)
+        return count
+
+class UniqueSlugMixin(TrackedFieldsMixin):
+    """Keeps slug unique by appending the lowest free number to
+    the slugified name, found with one prefix query.
+    """
+
+    def name_changed(self):
+        loaded = getattr(self, '_loaded_values', None)
+        return not self.slug or not loaded or \
+            loaded.get('name') != self.name
+
+    def create_unique_slug(self):
+        # Names of only non-Latin characters slugify to ''
+        slug = slugify(self.name) or self._meta.model_name
+        taken = set(self.__class__.objects.exclude(id=self.id) \
+            .filter(slug__startswith=slug) \
+            .values_list('slug', flat=True))
+        if slug not in taken:
+            return slug
+        suffixes = {candidate[len(slug):] for candidate in taken}
+        iterator = 2
+        while str(iterator) in suffixes:
+            iterator += 1
+        return slug + str(iterator)
+
+class TimeStatusQuerySet(models.QuerySet):
+    """Filters and annotations mirroring get_status(), evaluated
+    in the database from status and expected_completion_date.
+    """
+    UPCOMING_DAYS = 7
+
+    def _active(self):
+        return self.filter(status=self.model.ACTIVE,
+            expected_completion_date__isnull=False)
+
+    @staticmethod
+    def overdue_q(model, prefix='', date=None):
+        """Return the condition of overdue() for model, with each
+        lookup prefixed to reach model through a relation.
+        """
+        return Q(**{
+            prefix + 'status': model.ACTIVE,
+            prefix + 'expected_completion_date__lt':
+                date or datetime.date.today(),
+        })
+
+    def overdue(self, date=None):
+        return self.filter(self.overdue_q(self.model, date=date))
+
+    def upcoming(self):
+        today = datetime.date.today()
+        return self._active().filter(
+            expected_completion_date__gte=today,
+            expected_completion_date__lt=today + \
+                datetime.timedelta(days=self.UPCOMING_DAYS))
+
+    def ongoing(self):
+        today = datetime.date.today()
+        return self._active().filter(
+            expected_completion_date__gte=today + \
+                datetime.timedelta(days=self.UPCOMING_DAYS))
+
+    def with_time_status(self):
+        today = datetime.date.today()
+        soon = today + datetime.timedelta(days=self.UPCOMING_DAYS)
+        active = Q(status=self.model.ACTIVE,
+            expected_completion_date__isnull=False)
+        return self.annotate(time_status=Case(
+            When(self.overdue_q(self.model, date=today),
+                then=Value('overdue')),
+            When(active & Q(expected_completion_date__lt=soon),
+                then=Value('upcoming')),
+            When(active, then=Value('ongoing')),
+            default=Value(''),
+            output_field=CharField(),
+        ))
+
+    def status_histogram(self):
+        """Return {status: count} from a single GROUP BY query,
+        with overdue active items counted under 'overdue' instead
+        of 'active'.
+        """
+        overdue = self.overdue_q(self.model)
+        histogram = {status: 0 for status, label in
+            self.model.STATUS_CHOICES}
+        histogram['overdue'] = 0
+        rows = self.order_by().values('status').annotate(
+            total=Count('pk'),
+            overdue=Count('pk', filter=overdue))
+        for row in rows:
+            histogram[row['status']] = \
+                row['total'] - row['overdue']
+            histogram['overdue'] += row['overdue']
+        return histogram
+
+class AgreementQuerySet(models.QuerySet):
+
+    def with_dashboard_stats(self):
+        """Annotate the commitment, actor and action counts shown
+        on the dashboard using one aggregate query.
+        """
+        actors = Actor.objects.filter(agreement=OuterRef('pk')) \
+            .order_by().values('agreement') \
+            .annotate(count=Count('pk')).values('count')
+        action = 'commitment__action'
+        return self.annotate(
+            commitment_count=Count('commitment', distinct=True),
+            actor_count=Coalesce(Subquery(actors,
+                output_field=IntegerField()), Value(0)),
+            action_count=Count(action, distinct=True),
+            complete_count=Count(action, distinct=True,
+                filter=Q(commitment__action__status=Action.COMPLETE)),
+            active_count=Count(action, distinct=True,
+                filter=Q(commitment__action__status=Action.ACTIVE)),
+            overdue_count=Count(action, distinct=True,
+                filter=TimeStatusQuerySet.overdue_q(Action,
+                    prefix=action + '__')),
+            pending_count=Count(action, distinct=True,
+                filter=Q(commitment__action__status=Action.PENDING)),
+        )
+
+class ActorQuerySet(models.QuerySet):
+
+    def with_workload(self, agreement=None):
+        """Annotate ongoing, overdue and completed action counts
+        for every actor in one query, optionally limited to the
+        actions of a single agreement.
+        """
+        scope = Q()
+        if agreement is not None:
+            scope = Q(action__commitment__agreement=agreement)
+        overdue = TimeStatusQuerySet.overdue_q(Action,
+            prefix='action__')
+        return self.annotate(
+            ongoing_count=Count('action', distinct=True,
+                filter=scope & Q(action__status__in=(
+                    Action.PENDING, Action.ACTIVE))),
+            overdue_count=Count('action', distinct=True,
+                filter=scope & overdue),
+            completed_count=Count('action', distinct=True,
+                filter=scope & Q(action__status=Action.COMPLETE)),
+        )
+
+class Agreement(UniqueSlugMixin, models.Model):
+    objects = AgreementQuerySet.as_manager()
     
     name = models.CharField(max_length=255)
     slug = models.SlugField(
-        max_length=255, blank=True)
+        max_length=255, blank=True, unique=True)
     users = models.ManyToManyField(User, blank=True)
 
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
-        self.slug = self.create_unique_slug()
+        if self.name_changed():
+            self.slug = self.create_unique_slug()
         super(Agreement, self).save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -45,33 +295,19 @@ class Agreement(models.Model):
         return action_items.filter(status=Action.PENDING)
 
     def get_overdue_actions(self):
-        overdue = []
-        action_items = self.get_action_items()
-        for item in action_items:
-            if item.get_status() == 'overdue':
-                overdue.append(item.id)
-        actions = Action.objects.filter(id__in=overdue)
-        return actions
-
-    def create_unique_slug(self):
-        iterator = 1
-        slug = slugify(self.name)
-        while self.__class__.objects.exclude(
-            id=self.id).filter(slug=slug):
-            iterator += 1
-            slug = slugify(self.name) + str(iterator)
-        return slug
+        return self.get_action_items().overdue()
 
     def get_status_dict(self, model, queryset):
+        histogram = queryset.status_histogram()
         status_dict = {}
-        for status in model.STATUS_CHOICES:
-            status_dict[status[0]] = (
-                status[1], 
-                queryset.filter(status=status[0])
-            )
-            if status[0] == 'active':
-                status_dict = self.separate_overdue_items(
-                    status_dict)
+        for status, label in model.STATUS_CHOICES:
+            if status == model.ACTIVE:
+                status_dict[status] = (
+                    'Active (not overdue)', histogram[status])
+                status_dict['overdue'] = (
+                    'Overdue', histogram['overdue'])
+            else:
+                status_dict[status] = (label, histogram[status])
         return status_dict
 
     def get_commitment_dict(self):
@@ -86,31 +322,8 @@ class Agreement(models.Model):
             queryset=self.get_action_items()
         )
 
-    def get_overdue_items(self, queryset):
-        overdue = []
-        for item in queryset:
-            if item.get_status() == 'overdue':
-                overdue.append(item.id)
-        return queryset.filter(id__in=overdue)
-
     def get_overdue_commitments(self):
-        overdue = []
-        for item in self.commitment_set.all():
-            if item.get_status() == 'overdue':
-                overdue.append(item.id)
-        return Commitment.objects.filter(id__in=overdue)
-
-    def separate_overdue_items(self, item_dict):
-        queryset = item_dict['active'][1]
-        overdue_items = self.get_overdue_items(queryset)
-        item_dict['overdue'] = ('Overdue', overdue_items)
-        item_dict['active'] = (
-            'Active (not overdue)',
-            queryset.exclude(
-                id__in=overdue_items.values_list(
-                    'id', flat=True))
-        )
-        return item_dict
+        return self.commitment_set.overdue()
 
 class Overview(models.Model):
 
@@ -122,10 +335,10 @@ class Overview(models.Model):
     hero_video = models.CharField(max_length=255, 
         blank=True)
     hero_image = models.ImageField(
-        storage=storage_backends.PrivateMediaStorage(), 
+        storage=storage_backends.private_storage, 
         upload_to='images/', blank=True, null=True)
     story_image = models.ImageField(
-        storage=storage_backends.PrivateMediaStorage(), 
+        storage=storage_backends.private_storage, 
         upload_to='images/', blank=True, null=True)
     story_part1 = models.TextField(blank=True)
     story_part2 = models.TextField(blank=True)
@@ -134,7 +347,7 @@ class Overview(models.Model):
     challenges_text = models.TextField(blank=True)
     commitment_chart_text = models.TextField(blank=True)
     commitments_image = models.ImageField(
-        storage=storage_backends.PrivateMediaStorage(), 
+        storage=storage_backends.private_storage, 
         upload_to='images/', blank=True, null=True)
     about_us = models.TextField(blank=True)
     methodology = models.TextField(blank=True)
@@ -161,11 +374,11 @@ class Overview(models.Model):
         return reverse('overview-detail', kwargs={
             'agreement':self.agreement.slug, 'pk':self.id})
 
-class CommitmentCategory(models.Model):
+class CommitmentCategory(UniqueSlugMixin, models.Model):
     
     name = models.CharField(max_length=255)
     slug = models.SlugField(
-        max_length=255, blank=True)
+        max_length=255, blank=True, unique=True)
     description = models.TextField(blank=True)
     agreement = models.ForeignKey(Agreement,
         on_delete=models.SET_NULL,
@@ -180,18 +393,10 @@ class CommitmentCategory(models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
-        self.slug = self.create_unique_slug()
+        if self.name_changed():
+            self.slug = self.create_unique_slug()
         super(CommitmentCategory, self).save(*args, **kwargs)
 
-    def create_unique_slug(self):
-        iterator = 1
-        slug = slugify(self.name)
-        while self.__class__.objects.exclude(
-            id=self.id).filter(slug=slug):
-            iterator += 1
-            slug = slugify(self.name) + str(iterator)
-        return slug
-        
     def get_absolute_url(self):
         return reverse('commitment-category-detail',
             kwargs={
@@ -206,7 +411,8 @@ class CommitmentCategory(models.Model):
                 'agreement':self.agreement.slug
             })
 
-class Commitment(models.Model):
+class Commitment(TrackedFieldsMixin, models.Model):
+    objects = TimeStatusQuerySet.as_manager()
     PENDING = 'pending'
     ACTIVE = 'active'
     COMPLETE = 'complete'
@@ -244,6 +450,15 @@ class Commitment(models.Model):
 
     class Meta:
         ordering = ('category', 'order_num')
+        indexes = [
+            models.Index(fields=['agreement', 'category', 'order_num'],
+                name='commitment_agreement_order'),
+            models.Index(fields=['status'],
+                name='commitment_status'),
+            models.Index(fields=['expected_completion_date'],
+                condition=Q(status='active'),
+                name='commitment_active_expected'),
+        ]
 
     def __str__(self):
         return self.name
@@ -264,13 +479,26 @@ class Commitment(models.Model):
             new = True
         super(Commitment, self).save(*args, **kwargs)
         if new:
-            update = Update.objects.create(
-                description='Commitment Added',
-                _type=Update.ADDITION,
-                commitment=self,
-            )
+            self.get_addition().save()
+
+    def get_addition(self):
+        return Update(
+            description='Commitment Added',
+            _type=Update.ADDITION,
+            commitment_id=self.pk,
+        )
+
+    def get_revisions(self, update_fields=None):
+        return [Update.get_revision(field, old, new,
+            commitment_id=self.pk) for field, old, new
+            in self.get_changes(update_fields=update_fields)]
 
     def get_actions(self):
+        # CommitmentList prefetches action_set already ordered
+        #  by status
+        if 'action_set' in getattr(
+            self, '_prefetched_objects_cache', {}):
+            return self.action_set.all()
         return self.action_set.order_by('status')
 
     def get_active_actions(self):
@@ -295,12 +523,15 @@ class Commitment(models.Model):
         return None
     
     def get_status(self):
+        if hasattr(self, 'time_status'):
+            return self.time_status
         date = self.expected_completion_date
         if date and self.status == self.ACTIVE:
-            if date < datetime.date.today():
+            today = datetime.date.today()
+            if date < today:
                 return 'overdue'
-            elif date + datetime.timedelta(days=7) < \
-            datetime.date.today():
+            elif date < today + datetime.timedelta(
+                days=TimeStatusQuerySet.UPCOMING_DAYS):
                 return 'upcoming'
             else:
                 return 'ongoing'
@@ -334,6 +565,7 @@ class Commitment(models.Model):
             return True
 
 class Actor(models.Model):
+    objects = ActorQuerySet.as_manager()
 
     name = models.CharField(max_length=255)
     agreement = models.ManyToManyField(Agreement, 
@@ -366,14 +598,10 @@ class Actor(models.Model):
             Q(status=Action.ACTIVE))
 
     def get_overdue_actions(self):
-        i = 0
-        for action in self.action_set.filter(
-            status=Action.ACTIVE):
-            if action.get_status() == 'overdue':
-                i += 1
-        return i
-
-class Action(models.Model):
+        return self.action_set.overdue().count()
+
+class Action(TrackedFieldsMixin, models.Model):
+    objects = TimeStatusQuerySet.as_manager()
     PENDING = 'pending'
     ACTIVE = 'active'
     COMPLETE = 'complete'
@@ -406,6 +634,15 @@ class Action(models.Model):
     completion_date = models.DateField(
         blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expected_completion_date'],
+                name='action_status_expected'),
+            models.Index(fields=['expected_completion_date'],
+                condition=Q(status='active'),
+                name='action_active_expected'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -425,20 +662,32 @@ class Action(models.Model):
             new = True
         super(Action, self).save(*args, **kwargs)
         if new:
-            update = Update.objects.create(
-                description='Action Added',
-                _type=Update.ADDITION,
-                action=self,
-                commitment=self.commitment,
-            )
+            self.get_addition().save()
+
+    def get_addition(self):
+        return Update(
+            description='Action Added',
+            _type=Update.ADDITION,
+            action_id=self.pk,
+            commitment_id=self.commitment_id,
+        )
+
+    def get_revisions(self, update_fields=None):
+        return [Update.get_revision(field, old, new,
+            action_id=self.pk, commitment_id=self.commitment_id)
+            for field, old, new in self.get_changes(
+                update_fields=update_fields)]
 
     def get_status(self):
+        if hasattr(self, 'time_status'):
+            return self.time_status
         date = self.expected_completion_date
         if date and self.status == self.ACTIVE:
-            if date < datetime.date.today():
+            today = datetime.date.today()
+            if date < today:
                 return 'overdue'
-            elif date + datetime.timedelta(days=7) < \
-            datetime.date.today():
+            elif date < today + datetime.timedelta(
+                days=TimeStatusQuerySet.UPCOMING_DAYS):
                 return 'upcoming'
             else:
                 return 'ongoing'
@@ -471,13 +720,98 @@ class Action(models.Model):
         if self.get_status() == 'overdue':
             return True
 
-class Attachment(models.Model):
+class Blob(models.Model):
+    """A stored file shared by every row that uploaded the same
+    content, deleted when the last of them lets go of it.
+    """
+
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def release(cls, name, storage):
+        """Drop one reference to the blob stored as name, deleting
+        the file once nothing refers to it. Files stored before
+        deduplication have no blob and are left alone.
+        """
+        with transaction.atomic():
+            blob = cls.objects.select_for_update() \
+                .filter(name=name).first()
+            if blob is None:
+                return
+            if blob.ref_count > 1:
+                cls.objects.filter(pk=blob.pk).update(
+                    ref_count=F('ref_count') - 1)
+                return
+            blob.delete()
+            transaction.on_commit(lambda: storage.delete(name))
+
+class BlobFieldFile(FieldFile):
+    """Stores each distinct content once, under its SHA-256, and
+    points every later upload of it at the existing Blob.
+    """
+
+    def save(self, name, content, save=True):
+        digest = getattr(content, 'sha256', None) or \
+            self.get_digest(content)
+        blobs = Blob.objects.filter(digest=digest)
+        # The row already holds a reference to the blob it was
+        #  loaded with, so uploading that content again adds none
+        previous = getattr(self.instance, '_loaded_values', {}) \
+            .get(self.field.attname)
+        blob = blobs.filter(name=previous).first() if previous \
+            else None
+        if blob is None:
+            if blobs.update(ref_count=F('ref_count') + 1):
+                blob = blobs.get()
+            else:
+                blob = self.store_blob(digest, name, content)
+        self.name = blob.name
+        setattr(self.instance, self.field.name, self.name)
+        self._committed = True
+        if save:
+            self.instance.save()
+
+    def store_blob(self, digest, name, content):
+        stored = self.storage.save(
+            self.field.generate_filename(self.instance,
+                posixpath.join(digest, name)),
+            content, max_length=self.field.max_length)
+        try:
+            with transaction.atomic():
+                return Blob.objects.create(digest=digest,
+                    name=stored, size=content.size, ref_count=1)
+        except IntegrityError:
+            # Stored concurrently by another upload of the content
+            self.storage.delete(stored)
+            Blob.objects.filter(digest=digest).update(
+                ref_count=F('ref_count') + 1)
+            return Blob.objects.get(digest=digest)
+
+    def get_digest(self, content):
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        return sha256.hexdigest()
+
+class BlobFileField(models.FileField):
+    attr_class = BlobFieldFile
+
+class Attachment(TrackedFieldsMixin, models.Model):
 
     name = models.CharField(max_length=255)
-    file = models.FileField(
-        storage=storage_backends.PrivateMediaStorage(),
+    file = BlobFileField(
+        storage=storage_backends.private_storage,
         upload_to='files/', blank=True, null=True)
     description = models.TextField(blank=True)
+    # Text extracted from the file for search
+    text = models.TextField(blank=True, editable=False)
     commitment = models.ForeignKey(Commitment, 
         models.SET_NULL, blank=True, null=True)
     action = models.ForeignKey(Action, 
@@ -505,7 +839,10 @@ class Attachment(models.Model):
             new = True
         if self.action:
             self.commitment = self.action.commitment
+        previous = getattr(self, '_loaded_values', {}).get('file')
         super(Attachment, self).save(*args, **kwargs)
+        if previous and previous != self.file.name:
+            Blob.release(previous, self.file.storage)
         if new:
             update = Update.objects.create(
                 description='Attachment Added',
@@ -514,21 +851,40 @@ class Attachment(models.Model):
                 action=self.action,
             )
 
+    def get_revisions(self, update_fields=None):
+        return [Update(
+            _type=Update.OTHER,
+            description=Update.get_description_string(
+                self, old, new, field.name),
+            action_id=self.action_id,
+            commitment_id=self.commitment_id,
+        ) for field, old, new in self.get_changes(
+            'file', 'description', 'commitment', 'action',
+            update_fields=update_fields)]
+
 class UpdateManager(models.Manager):
 
     def add_delay(self, action, date):
+        update = self.build_delay(action, date)
+        update.save()
+        return update
+
+    def build_delay(self, action, date):
+        """Return an unsaved delay update for action, using only
+        its foreign key ids so nothing related is fetched.
+        """
         delay = date - action.expected_completion_date
-        update = Update.objects.create(
+        return Update(
             description='{0} Days Past Deadline - {1}'.format(
                 delay.days,
                 action.expected_completion_date
             ),
             _type=Update.DELAY,
-            commitment=action.commitment,
-            action=action,
-            actor=action.responsible_party,
+            deadline=action.expected_completion_date,
+            commitment_id=action.commitment_id,
+            action_id=action.id,
+            actor_id=action.responsible_party_id,
         )
-        return update
 
 class Update(models.Model):
     objects = UpdateManager()
@@ -567,9 +923,19 @@ class Update(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     progress_toward_goal = models.CharField(max_length=255,
         blank=True)
+    # The deadline a delay update was recorded for
+    deadline = models.DateField(blank=True, null=True)
 
     class Meta:
         ordering = ['-date_created']
+        indexes = [
+            models.Index(fields=['commitment', '-date_created'],
+                name='update_commitment_created'),
+            models.Index(fields=['action', '-date_created'],
+                name='update_action_created'),
+            models.Index(fields=['-date_created'],
+                name='update_created'),
+        ]
 
     def __str__(self):
         if self.action:
@@ -593,60 +959,19 @@ class Update(models.Model):
         return self
 
     @receiver(pre_save, sender=Commitment)
-    def save_commitment(sender, instance, **kwargs):
-        try:
-            obj = sender.objects.get(pk=instance.pk)
-        except sender.DoesNotExist:
-            pass
-        else:
-            for field in sender._meta.get_fields():
-                Update.save_revision(
-                    field, obj, instance, 'commitment')
+    def save_commitment(sender, instance, update_fields, **kwargs):
+        Update.objects.bulk_create(
+            instance.get_revisions(update_fields))
 
     @receiver(pre_save, sender=Action)
-    def save_action(sender, instance, **kwargs):
-        try:
-            obj = sender.objects.get(pk=instance.pk)
-        except sender.DoesNotExist:
-            pass
-        else:
-            for field in sender._meta.get_fields():
-                update = Update.save_revision(
-                    field, obj, instance, 'action')
-                if update:
-                    update.add_commitment()
+    def save_action(sender, instance, update_fields, **kwargs):
+        Update.objects.bulk_create(
+            instance.get_revisions(update_fields))
 
     @receiver(pre_save, sender=Attachment)
-    def save_attachment(sender, instance, **kwargs):
-        try:
-            obj = sender.objects.get(pk=instance.pk)
-        except sender.DoesNotExist:
-            pass
-        else:
-            for field in ('file', 'description', 
-                'commitment', 'action'):
-                update = Update.save_attachment_revision(
-                    field, obj, instance)
-
-    def save_attachment_revision(field, obj, instance):
-        try:
-            old = getattr(obj, field)
-            new = getattr(instance, field)
-            if old != new:
-                update = Update.objects.create(
-                    _type=Update.OTHER,
-                    description=Update.get_description_string(
-                    instance, old, new, field)
-                )
-                for field in ('action', 'commitment'):
-                    setattr(update, field, 
-                        getattr(instance, field)
-                    )
-                update.save()
-                return update
-        except Exception as error:
-            print(error)
-            pass
+    def save_attachment(sender, instance, update_fields, **kwargs):
+        Update.objects.bulk_create(
+            instance.get_revisions(update_fields))
 
     def get_description_string(instance, old, new, field):
         if old in (None, ''):
@@ -675,29 +1000,20 @@ class Update(models.Model):
         # update.save()
         return update
 
-    def save_revision(field, obj, instance, model_name):
-        try:
-            old = getattr(obj, field.name)
-            new = getattr(instance, field.name)
-            if old != new:
-                update = Update.objects.create(
-                    description='{0} changed from {1} to {2}'\
-                    .format(field.name.title(), old, new),
-                    _type=Update.REVISION,
-                )
-                setattr(update, model_name, instance)
-                update.save()
-                return update
-        except Exception as error:
-            print(error)
-            pass
+    def get_revision(field, old, new, **related_ids):
+        return Update(
+            description='{0} changed from {1} to {2}'\
+                .format(field.name.title(), old, new),
+            _type=Update.REVISION,
+            **related_ids
+        )
 
 class OverviewModel(models.Model):
 
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     image = models.ImageField(
-        storage=storage_backends.PrivateMediaStorage(), 
+        storage=storage_backends.private_storage, 
         upload_to='images/', blank=True, null=True)
     commitments = models.ManyToManyField(Commitment, 
         blank=True)
@@ -717,7 +1033,7 @@ class Document(models.Model):
 
     name = models.CharField(max_length=255)
     document = models.FileField(
-        storage=storage_backends.PrivateMediaStorage(), 
+        storage=storage_backends.private_storage, 
         upload_to='docs/', blank=True, null=True)
     description = models.TextField(blank=True)
     date = models.DateField(blank=True, null=True)
@@ -730,6 +1046,24 @@ class Document(models.Model):
     class Meta:
         ordering = ('date',)
 
+class Rendition(models.Model):
+    """A resized copy of an uploaded image, at a fixed width and in
+    a web format, kept in the same storage as the original.
+    """
+
+    original = models.CharField(max_length=255, db_index=True)
+    file = models.ImageField(
+        storage=storage_backends.private_storage,
+        upload_to='renditions/', max_length=255)
+    width = models.PositiveIntegerField()
+    content_type = models.CharField(max_length=50)
+
+    class Meta:
+        ordering = ('width',)
+
+    def __str__(self):
+        return self.file.name
+
 class Achievement(OverviewModel):
 
     def get_update_url(self):
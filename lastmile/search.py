@@ -0,0 +1,285 @@
+"""Full-text search over commitments, actions, updates and
+attachment text.
+
+The index is kept by the database, so every write updates it,
+bulk ones included: GIN indexes over weighted tsvectors on
+PostgreSQL, and FTS5 tables filled by triggers on SQLite. Other
+databases are searched in Python. SQLite drops the triggers when
+a migration rebuilds an indexed table, so they are installed again
+after every migrate.
+"""
+import operator
+import re
+from collections import namedtuple
+from functools import reduce
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from pypdf import PdfReader
+from pypdf.errors import PyPdfError
+
+from .models import Action, Attachment, Commitment, Update
+
+# Ways of searching, picked by get_search_backend
+POSTGRESQL = 'postgresql'
+FTS5 = 'fts5'
+PYTHON = 'python'
+# PostgreSQL text search configuration. 'simple' does not stem,
+#  as not all of the text is English.
+SEARCH_CONFIG = 'simple'
+# Weight of the first indexed column and of the others, as
+#  ts_rank weighs the A and B labels by default
+SEARCH_WEIGHTS = (1.0, 0.4)
+# Most results returned by search, and query terms used
+SEARCH_RESULT_LIMIT = 50
+SEARCH_TERM_LIMIT = 10
+# Characters of extracted attachment text kept for the index
+ATTACHMENT_TEXT_LIMIT = 100000
+# Characters of context shown around the first match
+SNIPPET_LENGTH = 200
+
+SearchSource = namedtuple('SearchSource',
+    'kind model fields agreement_lookup related')
+SearchResult = namedtuple('SearchResult',
+    'kind object rank title snippet url')
+
+# Searchable models with their indexed fields, most important
+#  first, the lookup scoping them to agreements and the relations
+#  their titles and urls read
+SEARCH_SOURCES = (
+    SearchSource('commitment', Commitment,
+        ('name', 'description', 'status_description'),
+        'agreement', ('agreement',)),
+    SearchSource('action', Action, ('name', 'description'),
+        'commitment__agreement', ('commitment__agreement',)),
+    SearchSource('update', Update, ('description',),
+        'commitment__agreement',
+        ('commitment__agreement', 'action__commitment__agreement')),
+    SearchSource('attachment', Attachment,
+        ('name', 'description', 'text'),
+        'commitment__agreement', ('commitment__agreement',)),
+)
+
+
+def get_search_columns():
+    """Return the indexed column names of each searchable table.
+    """
+    return {source.model._meta.db_table: tuple(
+        source.model._meta.get_field(name).column
+        for name in source.fields) for source in SEARCH_SOURCES}
+
+def get_search_table(table):
+    return '{}_search'.format(table)
+
+def get_vector_sql(connection, columns, table=None):
+    """Return the weighted tsvector indexed over columns, with
+    column references qualified by table when given.
+    """
+    qn = connection.ops.quote_name
+    values = ["coalesce({}, '')".format(
+        qn(table) + '.' + qn(column) if table else qn(column))
+        for column in columns]
+    weighted = "setweight(to_tsvector('{0}'::regconfig, {1}), '{2}')"
+    vector = weighted.format(SEARCH_CONFIG, values[0], 'A')
+    if len(values) > 1:
+        vector += ' || ' + weighted.format(SEARCH_CONFIG,
+            " || ' ' || ".join(values[1:]), 'B')
+    return vector
+
+def has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+def get_index_statements(connection, search_columns):
+    qn = connection.ops.quote_name
+    statements = []
+    for table, columns in search_columns.items():
+        index = qn(get_search_table(table))
+        if connection.vendor == 'postgresql':
+            statements.append(
+                'CREATE INDEX IF NOT EXISTS {0} ON {1} '
+                'USING gin (({2}))'.format(index, qn(table),
+                    get_vector_sql(connection, columns)))
+        elif connection.vendor == 'sqlite':
+            names = ', '.join(qn(column) for column in columns)
+            new = ', '.join('new.' + qn(column) for column in columns)
+            old = ', '.join('old.' + qn(column) for column in columns)
+            insert = 'INSERT INTO {0}(rowid, {1}) VALUES ' \
+                '(new.id, {2});'.format(index, names, new)
+            delete = "INSERT INTO {0}({0}, rowid, {1}) VALUES " \
+                "('delete', old.id, {2});".format(index, names, old)
+            statements += [
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING "
+                "fts5({1}, content='{2}', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')".format(
+                    index, names, table),
+                'CREATE TRIGGER IF NOT EXISTS {0} AFTER INSERT ON {1} '
+                'BEGIN {2} END'.format(qn(table + '_search_insert'),
+                    qn(table), insert),
+                'CREATE TRIGGER IF NOT EXISTS {0} AFTER DELETE ON {1} '
+                'BEGIN {2} END'.format(qn(table + '_search_delete'),
+                    qn(table), delete),
+                'CREATE TRIGGER IF NOT EXISTS {0} AFTER UPDATE OF {1} '
+                'ON {2} BEGIN {3} {4} END'.format(
+                    qn(table + '_search_update'), names, qn(table),
+                    delete, insert),
+                "INSERT INTO {0}({0}) VALUES ('rebuild')".format(index),
+            ]
+    return statements
+
+def install_search_index(connection, search_columns):
+    """Create the index over search_columns, a dict of column names
+    by table, and fill it from the rows already there. Running it
+    again repairs the index. Does nothing on databases searched
+    in Python.
+    """
+    if connection.vendor == 'sqlite' and not has_fts5(connection):
+        return
+    with connection.cursor() as cursor:
+        for statement in get_index_statements(
+            connection, search_columns):
+            cursor.execute(statement)
+
+def get_search_backend(connection):
+    if connection.vendor == 'postgresql':
+        return POSTGRESQL
+    if connection.vendor == 'sqlite':
+        tables = set(connection.introspection.table_names())
+        if all(get_search_table(table) in tables
+            for table in get_search_columns()):
+            return FTS5
+    return PYTHON
+
+def get_terms(query):
+    return re.findall(r'\w+', query.lower())[:SEARCH_TERM_LIMIT]
+
+def rank_postgresql(source, queryset, terms, limit):
+    table = source.model._meta.db_table
+    vector = get_vector_sql(connection,
+        get_search_columns()[table], table)
+    tsquery = "to_tsquery('{}'::regconfig, %s)".format(
+        SEARCH_CONFIG)
+    # Every term, matching words it prefixes
+    params = [' & '.join(term + ':*' for term in terms)]
+    queryset = queryset.filter(RawSQL(
+        '{0} @@ {1}'.format(vector, tsquery), params,
+        output_field=BooleanField()))
+    queryset = queryset.annotate(rank=RawSQL(
+        'ts_rank({0}, {1})'.format(vector, tsquery), params,
+        output_field=FloatField()))
+    return [(instance, instance.rank)
+        for instance in queryset.order_by('-rank')[:limit]]
+
+def rank_fts5(source, queryset, terms, limit):
+    qn = connection.ops.quote_name
+    table = source.model._meta.db_table
+    index = qn(get_search_table(table))
+    weights = ', '.join(str(SEARCH_WEIGHTS[min(i, 1)])
+        for i in range(len(source.fields)))
+    # Every term, matching words it prefixes
+    params = [' '.join('"{}"*'.format(term) for term in terms)]
+    queryset = queryset.filter(pk__in=RawSQL(
+        'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(index),
+        params))
+    # bm25 is lower for better matches
+    queryset = queryset.annotate(rank=RawSQL(
+        'SELECT -bm25({0}, {1}) FROM {0} WHERE {0} MATCH %s '
+        'AND rowid = {2}.{3}'.format(index, weights, qn(table),
+            qn(source.model._meta.pk.column)), params,
+        output_field=FloatField()))
+    return [(instance, instance.rank)
+        for instance in queryset.order_by('-rank')[:limit]]
+
+def rank_python(source, queryset, terms, limit):
+    condition = Q()
+    for term in terms:
+        condition &= reduce(operator.or_, (
+            Q(**{name + '__icontains': term})
+            for name in source.fields))
+    ranked = []
+    for instance in queryset.filter(condition):
+        rank = 0
+        for i, name in enumerate(source.fields):
+            value = (getattr(instance, name) or '').lower()
+            rank += SEARCH_WEIGHTS[min(i, 1)] * sum(
+                value.count(term) for term in terms)
+        ranked.append((instance, rank))
+    ranked.sort(key=operator.itemgetter(1), reverse=True)
+    return ranked[:limit]
+
+RANKERS = {
+    POSTGRESQL: rank_postgresql,
+    FTS5: rank_fts5,
+    PYTHON: rank_python,
+}
+
+def search(query, agreements, limit=SEARCH_RESULT_LIMIT):
+    """Return up to limit SearchResults for query in agreements,
+    best first. Each term must match, or prefix a word.
+    """
+    terms = get_terms(query)
+    if not terms:
+        return []
+    rank = RANKERS[get_search_backend(connection)]
+    results = []
+    for source in SEARCH_SOURCES:
+        queryset = source.model.objects.filter(**{
+            source.agreement_lookup + '__in': agreements
+        }).select_related(*source.related)
+        for instance, score in rank(source, queryset, terms, limit):
+            results.append(SearchResult(
+                kind=source.kind,
+                object=instance,
+                rank=score,
+                title=getattr(instance, source.fields[0]),
+                snippet=get_snippet(instance, source.fields[1:], terms),
+                url=get_result_url(instance),
+            ))
+    results.sort(key=operator.attrgetter('rank'), reverse=True)
+    return results[:limit]
+
+def get_snippet(instance, fields, terms):
+    """Return the text around the first term found in fields.
+    """
+    for name in fields:
+        value = getattr(instance, name) or ''
+        lower = value.lower()
+        found = [lower.find(term) for term in terms if term in lower]
+        if found:
+            start = max(min(found) - SNIPPET_LENGTH // 4, 0)
+            end = start + SNIPPET_LENGTH
+            return '{0}{1}{2}'.format('…' if start else '',
+                value[start:end].strip(),
+                '…' if end < len(value) else '')
+    return ''
+
+def get_result_url(instance):
+    if isinstance(instance, Update):
+        instance = instance.action or instance.commitment
+    return instance.get_absolute_url()
+
+def extract_text(field_file, max_size=None):
+    """Return the text of a PDF file, cut to ATTACHMENT_TEXT_LIMIT
+    characters, or '' for other files, unreadable ones and those
+    larger than max_size bytes.
+    """
+    if not field_file or not field_file.name.lower().endswith('.pdf'):
+        return ''
+    pages = []
+    length = 0
+    try:
+        if max_size is not None and field_file.size > max_size:
+            return ''
+        with field_file.open('rb'):
+            for page in PdfReader(field_file).pages:
+                pages.append(page.extract_text() or '')
+                length += len(pages[-1])
+                if length >= ATTACHMENT_TEXT_LIMIT:
+                    break
+    except (OSError, ValueError, PyPdfError):
+        return ''
+    # PostgreSQL text cannot hold NUL characters
+    return '\n'.join(pages)[:ATTACHMENT_TEXT_LIMIT].replace('\x00', '')
@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models.signals import m2m_changed, post_delete
+from django.db.models.signals import post_migrate
+from django.db.models.signals import post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .context_processors import clear_user_agreements
+from .functions import create_renditions, delete_renditions
+from .functions import touch_agreement_microsites, touch_microsites
+from .models import Achievement, Agreement, Attachment, Blob
+from .models import Challenge, Commitment
+from .models import CommitmentCategory, Document, Overview
+from .models import Recommendation
+from .search import FTS5, extract_text, get_search_backend
+from .search import get_search_columns, install_search_index
+
+# Models whose rows render on the microsite of their overview
+MICROSITE_MODELS = (Achievement, Challenge, Document, Recommendation)
+# Models whose uploaded images get renditions
+IMAGE_MODELS = (Overview, Achievement, Challenge, Recommendation)
+
+
+def clear_agreement_users(agreement_id):
+    if agreement_id is not None:
+        clear_user_agreements(Agreement.users.through.objects \
+            .filter(agreement_id=agreement_id) \
+            .values_list('user_id', flat=True))
+
+@receiver(post_save, sender=Agreement)
+def agreement_saved(sender, instance, created, **kwargs):
+    # New agreements have no users yet, and saves that change
+    #  nothing tracked leave the cached sidebar valid
+    if created or (hasattr(instance, '_loaded_values')
+        and not any(instance.get_changes())):
+        return
+    clear_agreement_users(instance.pk)
+
+@receiver(pre_delete, sender=Agreement)
+def agreement_deleted(sender, instance, **kwargs):
+    clear_agreement_users(instance.pk)
+
+@receiver(pre_save, sender=Overview)
+def overview_moved(sender, instance, **kwargs):
+    # An overview moved to another agreement also drops out of the
+    #  sidebar of the previous agreement's users
+    if instance.pk:
+        previous = Overview.objects.filter(pk=instance.pk) \
+            .values_list('agreement_id', flat=True).first()
+        if previous != instance.agreement_id:
+            clear_agreement_users(previous)
+
+@receiver(post_save, sender=Overview)
+@receiver(post_delete, sender=Overview)
+def overview_changed(sender, instance, **kwargs):
+    clear_agreement_users(instance.agreement_id)
+    touch_microsites([instance.pk])
+
+@receiver(m2m_changed, sender=Agreement.users.through)
+def agreement_users_changed(sender, instance, action, reverse,
+    pk_set, **kwargs):
+    if reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            clear_user_agreements([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        clear_user_agreements(pk_set)
+    elif action == 'pre_clear':
+        clear_agreement_users(instance.pk)
+
+def microsite_model_moved(sender, instance, **kwargs):
+    if instance.pk:
+        previous = sender.objects.filter(pk=instance.pk) \
+            .values_list('overview_id', flat=True).first()
+        if previous != instance.overview_id:
+            touch_microsites([previous])
+
+def microsite_model_changed(sender, instance, **kwargs):
+    touch_microsites([instance.overview_id])
+
+for model in MICROSITE_MODELS:
+    pre_save.connect(microsite_model_moved, sender=model)
+    post_save.connect(microsite_model_changed, sender=model)
+    post_delete.connect(microsite_model_changed, sender=model)
+
+@receiver(post_save, sender=Commitment)
+@receiver(post_delete, sender=Commitment)
+@receiver(post_save, sender=CommitmentCategory)
+@receiver(post_delete, sender=CommitmentCategory)
+def commitment_changed(sender, instance, **kwargs):
+    touch_agreement_microsites(instance.agreement_id)
+
+def note_changed_images(sender, instance, **kwargs):
+    fields = [field.name for field in sender._meta.fields
+        if isinstance(field, models.ImageField)]
+    # Files still uncommitted before the save are new uploads
+    instance._uploaded_images = [name for name in fields
+        if getattr(instance, name)
+        and not getattr(instance, name)._committed]
+    # Originals replaced or cleared by the save
+    instance._replaced_images = []
+    if instance.pk:
+        previous = sender.objects.filter(pk=instance.pk) \
+            .values(*fields).first() or {}
+        instance._replaced_images = [previous[name]
+            for name in fields if previous.get(name)
+            and previous[name] != getattr(instance, name).name]
+
+def render_changed_images(sender, instance, **kwargs):
+    for name in getattr(instance, '_replaced_images', []):
+        delete_renditions(name)
+    for name in getattr(instance, '_uploaded_images', []):
+        create_renditions(getattr(instance, name))
+
+for model in IMAGE_MODELS:
+    pre_save.connect(note_changed_images, sender=model)
+    post_save.connect(render_changed_images, sender=model)
+
+@receiver(post_delete, sender=Attachment)
+def attachment_deleted(sender, instance, **kwargs):
+    if instance.file:
+        Blob.release(instance.file.name, instance.file.storage)
+
+@receiver(post_save, sender=Attachment)
+def attachment_saved(sender, instance, created, **kwargs):
+    # The snapshot still holds the loaded values here
+    loaded = getattr(instance, '_loaded_values', {})
+    if not created and loaded.get('file') == instance.file.name:
+        return
+    transaction.on_commit(lambda: index_attachment(instance))
+
+def index_attachment(attachment):
+    text = extract_text(attachment.file,
+        settings.LASTMILE_SEARCH_EXTRACT_MAX_SIZE)
+    if text != attachment.text:
+        attachment.text = text
+        Attachment.objects.filter(pk=attachment.pk).update(text=text)
+
+@receiver(post_migrate)
+def repair_search_index(sender, using, **kwargs):
+    # SQLite drops the triggers of the tables a migration rebuilds
+    connection = connections[using]
+    if sender.name == 'lastmile' and \
+        get_search_backend(connection) == FTS5:
+        install_search_index(connection, get_search_columns())
@@ -1,7 +1,66 @@
 from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+
+from lastmile.functions import get_renditions
+
 register = template.Library()
 
 
 @register.filter
 def verbose_name(obj):
-    return obj._meta.verbose_name
\ No newline at end of file
+    return obj._meta.verbose_name
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, direction, cursor):
+    params = context['request'].GET.copy()
+    for key in ('after', 'before'):
+        params.pop(key, None)
+    params[direction] = cursor
+    return '?{}'.format(params.urlencode())
+
+@register.filter
+def verbose_name_plural(obj):
+    return obj._meta.verbose_name_plural
+
+def get_srcset(renditions):
+    return format_html_join(', ', '{} {}w', ((rendition.file.url,
+        rendition.width) for rendition in renditions))
+
+@register.simple_tag
+def picture(image, sizes='100vw', **attrs):
+    """Render an uploaded image as a <picture> whose srcset offers
+    its WebP and JPEG renditions, or as a plain <img> of the
+    original until renditions exist. Keyword arguments become
+    attributes of the <img>.
+    """
+    if not image:
+        return ''
+    renditions = get_renditions(image)
+    webp = [rendition for rendition in renditions
+        if rendition.content_type == 'image/webp']
+    jpeg = [rendition for rendition in renditions
+        if rendition.content_type == 'image/jpeg']
+    if not jpeg:
+        return format_html('<img src="{}"{}>', image.url,
+            flatatt(attrs))
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        get_srcset(webp), sizes, jpeg[-1].file.url,
+        get_srcset(jpeg), sizes, flatatt(attrs))
+
+@register.filter
+def rendition(image, width):
+    """URL of the narrowest JPEG rendition of an uploaded image at
+    least width pixels wide, for places srcset cannot reach such as
+    CSS backgrounds. Falls back to the widest, then the original.
+    """
+    if not image:
+        return ''
+    jpeg = [rendition for rendition in get_renditions(image)
+        if rendition.content_type == 'image/jpeg']
+    for candidate in jpeg:
+        if candidate.width >= int(width):
+            return candidate.file.url
+    return jpeg[-1].file.url if jpeg else image.url
@@ -1,3 +1,1054 @@
-from django.test import TestCase
+import base64
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django_lastmile.storage_backends import PrivateMediaStorage
+from django_lastmile.storage_backends import private_storage
+from PIL import Image
+from storages.backends.s3boto3 import S3Boto3Storage
+
+try:
+    import requests
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+from .functions import create_renditions
+from .models import Achievement, Action, Actor, Agreement, Attachment
+from .models import Blob, BlobFieldFile
+from .models import Commitment, CommitmentCategory, Document
+from .models import Overview, Rendition, TimeStatusQuerySet, Update
+from .search import FTS5, PYTHON, get_search_backend
+
+
+def use_test_storage(test_case, storage):
+    """Point storage at a throwaway bucket under moto when it is S3,
+    or at a temporary MEDIA_ROOT when it is local.
+    """
+    if isinstance(storage, S3Boto3Storage):
+        if mock_aws is None:
+            test_case.skipTest('moto is not installed')
+        mock = mock_aws()
+        mock.start()
+        test_case.addCleanup(mock.stop)
+        storage.connection.create_bucket(Bucket=storage.bucket_name)
+    else:
+        media_root = tempfile.mkdtemp()
+        test_case.addCleanup(shutil.rmtree, media_root)
+        overrides = test_case.settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        test_case.addCleanup(overrides.disable)
+
+def make_pdf(text):
+    """Return the bytes of a one page PDF showing text."""
+    stream = 'BT /F1 12 Tf 72 720 Td ({}) Tj ET'.format(text)
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+        '/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>',
+        '<< /Length {0} >>\nstream\n{1}\nendstream'.format(
+            len(stream), stream),
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    pdf = '%PDF-1.4\n'
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += '{0} 0 obj\n{1}\nendobj\n'.format(i, body)
+    xref = len(pdf)
+    pdf += 'xref\n0 {}\n0000000000 65535 f \n'.format(len(objects) + 1)
+    pdf += ''.join('{:010d} 00000 n \n'.format(offset)
+        for offset in offsets)
+    pdf += 'trailer\n<< /Size {0} /Root 1 0 R >>\n' \
+        'startxref\n{1}\n%%EOF\n'.format(len(objects) + 1, xref)
+    return pdf.encode()
+
+
+class LastMileTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='staff', is_staff=True)
+        self.agreement = Agreement.objects.create(name='Agreement')
+        self.agreement.users.add(self.user)
+        self.client.force_login(self.user)
+
+    def add_actions(self, count):
+        start = Action.objects.count()
+        for i in range(start, start + count):
+            category = CommitmentCategory.objects.create(
+                name='Category {}'.format(i),
+                agreement=self.agreement)
+            commitment = Commitment.objects.create(
+                name='Commitment {}'.format(i),
+                category=category,
+                agreement=self.agreement)
+            actor = Actor.objects.create(
+                name='Actor {}'.format(i), user=User.objects.create(
+                    username='actor{}'.format(i)))
+            actor.agreement.add(self.agreement)
+            action = Action.objects.create(
+                name='Action {}'.format(i),
+                commitment=commitment,
+                status=Action.ACTIVE,
+                expected_completion_date=datetime.date.today())
+            action.responsible_parties.add(actor)
+
+    def count_queries(self, url):
+        """Count the queries of a request made after a warm-up
+        request, so per-user caches are already populated.
+        """
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+class TimeStatusTest(LastMileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        commitment = Commitment.objects.create(name='Commitment',
+            agreement=self.agreement)
+        today = datetime.date.today()
+        soon = TimeStatusQuerySet.UPCOMING_DAYS
+        for status, days in ((Action.ACTIVE, -1), (Action.ACTIVE, 0),
+            (Action.ACTIVE, soon - 1), (Action.ACTIVE, soon),
+            (Action.ACTIVE, None), (Action.COMPLETE, -1),
+            (Action.PENDING, soon)):
+            Action.objects.create(name='Action', status=status,
+                commitment=commitment,
+                expected_completion_date=None if days is None \
+                    else today + datetime.timedelta(days=days))
+
+    def test_database_status_matches_get_status(self):
+        annotated = Action.objects.with_time_status()
+        statuses = {action.pk: Action.objects.get(pk=action.pk)
+            .get_status() for action in annotated}
+        for action in annotated:
+            self.assertEqual(action.time_status, statuses[action.pk])
+        for name in ('overdue', 'upcoming', 'ongoing'):
+            self.assertEqual(
+                set(getattr(Action.objects, name)().values_list(
+                    'pk', flat=True)),
+                {pk for pk, status in statuses.items()
+                    if status == name})
+        self.assertEqual(sorted(statuses.values()), ['', '', '',
+            'ongoing', 'overdue', 'upcoming', 'upcoming'])
+
+
+class DashboardTest(LastMileTestCase):
+
+    def add_agreement(self, i):
+        agreement = Agreement.objects.create(
+            name='Agreement {}'.format(i))
+        agreement.users.add(self.user)
+        actor = Actor.objects.create(name='Actor {}'.format(i))
+        actor.agreement.add(agreement)
+        commitment = Commitment.objects.create(name='Commitment',
+            agreement=agreement)
+        today = datetime.date.today()
+        for status, days in ((Action.ACTIVE, -1), (Action.ACTIVE, 1),
+            (Action.COMPLETE, -1), (Action.PENDING, None)):
+            action = Action.objects.create(name='Action',
+                status=status, commitment=commitment,
+                expected_completion_date=None if days is None \
+                    else today + datetime.timedelta(days=days))
+            action.responsible_parties.add(actor)
+
+    def test_stats_match_agreement_methods(self):
+        self.add_agreement(1)
+        self.add_agreement(2)
+        response = self.client.get(reverse('dashboard'))
+        agreements = response.context['agreement_list']
+        self.assertEqual(len(agreements), 3)
+        for agreement in agreements:
+            self.assertEqual(
+                (agreement.commitment_count, agreement.actor_count,
+                    agreement.action_count, agreement.complete_count,
+                    agreement.active_count, agreement.overdue_count,
+                    agreement.pending_count),
+                (agreement.commitment_set.count(),
+                    agreement.actor_set.count(),
+                    agreement.get_action_items().count(),
+                    agreement.get_complete_actions().count(),
+                    agreement.get_active_actions().count(),
+                    len([action for action in
+                        agreement.get_action_items()
+                        if action.get_status() == 'overdue']),
+                    agreement.get_pending_actions().count()))
+
+    def test_query_count_is_constant(self):
+        url = reverse('dashboard')
+        self.add_agreement(1)
+        few = self.count_queries(url)
+        for i in range(2, 6):
+            self.add_agreement(i)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+
+class AgreementChartTest(LastMileTestCase):
+
+    def get_status_dict(self, model, items):
+        """Return the counts the per-status querysets of the old
+        get_status_dict() held.
+        """
+        status_dict = {}
+        for status, label in model.STATUS_CHOICES:
+            matching = [item for item in items if item.status == status]
+            if status == model.ACTIVE:
+                overdue = [item for item in matching
+                    if item.get_status() == 'overdue']
+                status_dict[status] = ('Active (not overdue)',
+                    len(matching) - len(overdue))
+                status_dict['overdue'] = ('Overdue', len(overdue))
+            else:
+                status_dict[status] = (label, len(matching))
+        return status_dict
+
+    def test_chart_data_matches_status_dicts(self):
+        today = datetime.date.today()
+        for i, (status, days) in enumerate((
+            (Commitment.ACTIVE, -1), (Commitment.ACTIVE, 1),
+            (Commitment.ACTIVE, None), (Commitment.FAILED, -1),
+            (Commitment.PENDING, None))):
+            date = None if days is None \
+                else today + datetime.timedelta(days=days)
+            commitment = Commitment.objects.create(
+                name='Commitment {}'.format(i), status=status,
+                agreement=self.agreement, expected_completion_date=date)
+            Action.objects.create(name='Action {}'.format(i),
+                status=status, commitment=commitment,
+                expected_completion_date=date)
+        response = self.client.get(self.agreement.get_absolute_url())
+        self.assertEqual(response.context['chart_data'], {
+            'commitment': self.get_status_dict(Commitment,
+                list(self.agreement.commitment_set.all())),
+            'action': self.get_status_dict(Action,
+                list(self.agreement.get_action_items())),
+        })
+        self.assertEqual(
+            response.context['chart_data']['action']['overdue'],
+            ('Overdue', 1))
+
+
+class ActorWorkloadTest(LastMileTestCase):
+
+    def test_counts_are_limited_to_the_agreement(self):
+        other = Agreement.objects.create(name='Other')
+        actor = Actor.objects.create(name='Actor')
+        actor.agreement.add(self.agreement, other)
+        overdue = datetime.date.today() - datetime.timedelta(days=1)
+        for agreement, statuses in ((self.agreement, (Action.ACTIVE,
+            Action.COMPLETE)), (other, (Action.ACTIVE, Action.ACTIVE,
+            Action.PENDING, Action.COMPLETE))):
+            commitment = Commitment.objects.create(name='Commitment',
+                agreement=agreement)
+            for status in statuses:
+                action = Action.objects.create(name='Action',
+                    status=status, commitment=commitment,
+                    expected_completion_date=overdue)
+                action.responsible_parties.add(actor)
+        response = self.client.get(self.agreement.get_absolute_url())
+        workload = response.context['actor_list'].get(pk=actor.pk)
+        self.assertEqual((workload.ongoing_count,
+            workload.overdue_count, workload.completed_count), (1, 1, 1))
+        workload = Actor.objects.with_workload().get(pk=actor.pk)
+        self.assertEqual((workload.ongoing_count,
+            workload.overdue_count, workload.completed_count), (4, 3, 2))
+
+
+class ActionListQueryTest(LastMileTestCase):
+
+    def test_query_count_is_constant(self):
+        url = reverse('action-list', kwargs={
+            'agreement': self.agreement.slug})
+        self.add_actions(2)
+        few = self.count_queries(url)
+        self.add_actions(20)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+
+class CommitmentListQueryTest(LastMileTestCase):
+
+    def test_query_count_is_constant(self):
+        url = reverse('commitment-list', kwargs={
+            'agreement': self.agreement.slug})
+        self.add_actions(2)
+        few = self.count_queries(url)
+        self.add_actions(20)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+
+class KeysetPaginationTest(LastMileTestCase):
+
+    def collect_pages(self, url, params):
+        names = []
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page_obj']
+            names.append([action.name for action in page])
+            if not page.has_next():
+                return names, response
+            params = {'page_size': 3, 'after': page.next_cursor}
+
+    def test_pages_cover_every_row_once(self):
+        url = reverse('action-list', kwargs={
+            'agreement': self.agreement.slug})
+        self.add_actions(8)
+        pages, response = self.collect_pages(
+            url, {'page_size': 3})
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual(
+            sum(pages, []),
+            list(Action.objects.order_by('id').values_list(
+                'name', flat=True)))
+        previous = self.client.get(url, {'page_size': 3,
+            'before': response.context['page_obj'].previous_cursor})
+        self.assertEqual(
+            [action.name for action in previous.context['page_obj']],
+            pages[1])
+
+    def test_display_order_is_kept(self):
+        categories = [CommitmentCategory.objects.create(
+            name='Category {}'.format(i), order_num=order_num,
+            agreement=self.agreement)
+            for i, order_num in enumerate((2, 1))]
+        for i, (category, order_num) in enumerate((
+            (None, 0), (categories[0], 1), (categories[1], 2),
+            (categories[0], 0), (None, 1))):
+            Commitment.objects.create(name='Commitment {}'.format(i),
+                category=category, order_num=order_num,
+                agreement=self.agreement)
+        for name in ('Actor B', 'Actor A', 'Actor C'):
+            Actor.objects.create(name=name).agreement.add(
+                self.agreement)
+        pages, response = self.collect_pages(reverse(
+            'commitment-list', kwargs={
+                'agreement': self.agreement.slug}), {'page_size': 3})
+        self.assertEqual(sum(pages, []), ['Commitment 2',
+            'Commitment 3', 'Commitment 1', 'Commitment 0',
+            'Commitment 4'])
+        pages, response = self.collect_pages(reverse('actor-list',
+            kwargs={'agreement': self.agreement.slug}),
+            {'page_size': 2})
+        self.assertEqual(sum(pages, []),
+            ['Actor B', 'Actor A', 'Actor C'])
+
+    def test_invalid_cursor(self):
+        url = reverse('action-list', kwargs={
+            'agreement': self.agreement.slug})
+        response = self.client.get(url, {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+        # Well formed cursors holding values the seek cannot use
+        for values in ([{}], ['not-an-id']):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(values).encode()).decode()
+            response = self.client.get(url, {'after': cursor})
+            self.assertEqual(response.status_code, 404)
+
+
+class ExportTest(LastMileTestCase):
+
+    def export(self):
+        url = reverse('action-export', kwargs={
+            'agreement': self.agreement.slug})
+        response = self.client.get(url)
+        return b''.join(response.streaming_content).decode() \
+            .splitlines()
+
+    def test_many_to_many_columns_are_flattened(self):
+        self.add_actions(1)
+        header, row = self.export()
+        self.assertNotIn('update', header.split(','))
+        self.assertTrue(row.endswith(',Actor 0'))
+
+    def test_query_count_is_constant(self):
+        url = reverse('action-export', kwargs={
+            'agreement': self.agreement.slug})
+        self.add_actions(2)
+        few = self.count_queries(url)
+        self.add_actions(20)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+    def test_export_formats(self):
+        self.add_actions(1)
+        url = reverse('action-export', kwargs={
+            'agreement': self.agreement.slug})
+        response = self.client.get(url, {'format': 'jsonl'})
+        record = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(record['responsible_parties'], ['Actor 0'])
+        self.assertEqual(record['expected_completion_date'],
+            datetime.date.today().isoformat())
+        response = self.client.get(url, {'format': 'typed-csv'})
+        header = b''.join(response.streaming_content).decode() \
+            .splitlines()[0].split(',')
+        self.assertIn('id:integer', header)
+        self.assertIn('expected_completion_date:date', header)
+        response = self.client.get(url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CheckDelaysTest(LastMileTestCase):
+
+    def test_delays_are_recorded_once_per_deadline(self):
+        self.add_actions(3)
+        monday = datetime.date.today() + datetime.timedelta(
+            days=7 - datetime.date.today().weekday())
+        call_command('check_delays', date=str(monday),
+            batch_size=2, stdout=StringIO())
+        call_command('check_delays', date=str(monday),
+            stdout=StringIO())
+        delays = Update.objects.filter(_type=Update.DELAY)
+        self.assertEqual(delays.count(), 3)
+        self.assertEqual(set(delays.values_list('deadline', flat=True)),
+            {datetime.date.today()})
+        action = Action.objects.first()
+        action.expected_completion_date = monday - \
+            datetime.timedelta(days=10)
+        action.save()
+        call_command('check_delays', date=str(monday),
+            stdout=StringIO())
+        self.assertEqual(delays.count(), 4)
+
+    def test_explicit_date_is_checked_on_any_weekday(self):
+        self.add_actions(1)
+        tuesday = datetime.date.today() + datetime.timedelta(
+            days=8 - datetime.date.today().weekday())
+        out = StringIO()
+        call_command('check_delays', date=str(tuesday), stdout=out)
+        self.assertNotIn('Waiting for Monday', out.getvalue())
+        self.assertEqual(Update.objects.filter(
+            _type=Update.DELAY).count(), 1)
+
+    def test_dry_run(self):
+        self.add_actions(1)
+        call_command('check_delays', date='2100-01-04',
+            dry_run=True, stdout=StringIO())
+        self.assertFalse(Update.objects.filter(
+            _type=Update.DELAY).exists())
+
+
+class RevisionTest(LastMileTestCase):
+
+    def test_changed_fields_are_recorded_in_one_insert(self):
+        self.add_actions(1)
+        action = Action.objects.get()
+        action.status = Action.COMPLETE
+        action.description = 'Done'
+        with CaptureQueriesContext(connection) as queries:
+            action.save()
+        self.assertEqual(
+            [query['sql'].split()[0] for query in queries
+                if query['sql'] not in ('BEGIN', 'COMMIT')],
+            ['INSERT', 'UPDATE'])
+        revisions = Update.objects.filter(_type=Update.REVISION)
+        self.assertEqual(
+            set(revisions.values_list('description', flat=True)),
+            {'Status changed from active to complete',
+                'Description changed from  to Done'})
+        self.assertTrue(all(update.commitment_id ==
+            action.commitment_id for update in revisions))
+        action.save()
+        self.assertEqual(revisions.count(), 2)
+
+
+    def test_snapshot_follows_partial_saves_and_refreshes(self):
+        self.add_actions(1)
+        action = Action.objects.get()
+        action.status = Action.COMPLETE
+        action.description = 'Done'
+        action.save(update_fields=['description'])
+        revisions = Update.objects.filter(_type=Update.REVISION)
+        self.assertEqual(
+            list(revisions.values_list('description', flat=True)),
+            ['Description changed from  to Done'])
+        action.save()
+        self.assertEqual(revisions.filter(
+            description='Status changed from active to complete',
+        ).count(), 1)
+        Action.objects.update(status=Action.FAILED)
+        action.refresh_from_db()
+        action.save()
+        self.assertEqual(revisions.count(), 2)
+
+class BulkUpdateTest(LastMileTestCase):
+
+    def test_bulk_update_records_revisions(self):
+        self.add_actions(5)
+        url = reverse('action-bulk-update', kwargs={
+            'agreement': self.agreement.slug})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        selected = list(Action.objects.values_list(
+            'pk', flat=True)[:3])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {
+                'objects': selected,
+                'status': Action.COMPLETE,
+            })
+        self.assertEqual(response.status_code, 302)
+        writes = [query['sql'].split()[0] for query in queries
+            if query['sql'].split()[0] in ('INSERT', 'UPDATE')]
+        self.assertEqual(writes.count('INSERT'), 1)
+        self.assertEqual(
+            Action.objects.filter(status=Action.COMPLETE).count(), 3)
+        self.assertEqual(Update.objects.filter(
+            _type=Update.REVISION,
+            description='Status changed from active to complete',
+        ).count(), 3)
+
+
+    def test_blank_fields_are_left_unchanged(self):
+        self.add_actions(2)
+        url = reverse('action-bulk-update', kwargs={
+            'agreement': self.agreement.slug})
+        form = self.client.get(url).context['form']
+        self.assertEqual(form['status'].value(), '')
+        self.assertEqual(form.fields['status'].choices[0],
+            ('', '---------'))
+        date = datetime.date.today() + datetime.timedelta(days=30)
+        response = self.client.post(url, {
+            'objects': list(Action.objects.values_list('pk', flat=True)),
+            'status': '',
+            'expected_completion_date': date.isoformat(),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(Action.objects.values_list(
+            'status', 'expected_completion_date')),
+            {(Action.ACTIVE, date)})
+
+class ImportTest(LastMileTestCase):
+
+    def export(self, name):
+        url = reverse(name, kwargs={'agreement': self.agreement.slug})
+        response = self.client.get(url)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_round_trip(self):
+        self.add_actions(3)
+        commitments = self.export('commitment-export')
+        actions = self.export('action-export')
+        target = Agreement.objects.create(name='Target')
+        target.users.add(self.user)
+        url = reverse('commitment-import', kwargs={
+            'agreement': target.slug})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with open(self.write_file(commitments), 'rb') as upload:
+            response = self.client.post(url, {'file': upload})
+        self.assertRedirects(response, reverse('commitment-list',
+            kwargs={'agreement': target.slug}),
+            fetch_redirect_response=False)
+        self.assertEqual(target.commitment_set.count(), 3)
+        url = reverse('action-import', kwargs={
+            'agreement': target.slug})
+        with open(self.write_file(actions), 'rb') as upload:
+            response = self.client.post(url, {'file': upload})
+        self.assertEqual(response.status_code, 302)
+        imported = Action.objects.filter(commitment__agreement=target)
+        self.assertEqual(
+            sorted(imported.values_list(
+                'name', 'commitment__name',
+                'responsible_parties__name')),
+            sorted(Action.objects.filter(
+                commitment__agreement=self.agreement).values_list(
+                'name', 'commitment__name',
+                'responsible_parties__name')))
+        self.assertEqual(target.commitmentcategory_set.count(), 3)
+        self.assertEqual(Update.objects.filter(
+            _type=Update.ADDITION, action__in=imported).count(), 3)
+
+    def test_invalid_rows_are_rejected(self):
+        path = self.write_file(
+            'name,status,expected_completion_date\n'
+            'Good,active,2020-01-01\n'
+            ',active,2020-01-01\n'
+            'Bad,sideways,someday\n')
+        with self.assertRaises(CommandError) as error:
+            call_command('import_csv', self.agreement.slug,
+                'commitments', path, stdout=StringIO())
+        self.assertIn('Row 3: name', str(error.exception))
+        self.assertIn('Row 4: status', str(error.exception))
+        self.assertFalse(Commitment.objects.exists())
+
+    def write_file(self, content):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'import.csv')
+        with open(path, 'w', newline='') as csv_file:
+            csv_file.write(content)
+        return path
+
+
+class UniqueSlugTest(TestCase):
+
+    def test_slug_takes_the_lowest_free_suffix(self):
+        slugs = [CommitmentCategory.objects.create(name='Health').slug
+            for i in range(3)]
+        self.assertEqual(slugs, ['health', 'health2', 'health3'])
+        CommitmentCategory.objects.get(slug='health2').delete()
+        CommitmentCategory.objects.create(name='Healthcare')
+        self.assertEqual(
+            CommitmentCategory.objects.create(name='Health').slug,
+            'health2')
+
+    def test_names_without_latin_characters(self):
+        slugs = [Agreement.objects.create(name='Гэрээ').slug
+            for i in range(2)]
+        self.assertEqual(slugs, ['agreement', 'agreement2'])
+
+    def test_slug_is_kept_until_the_name_changes(self):
+        agreement = Agreement.objects.create(name='First Agreement')
+        agreement = Agreement.objects.get(pk=agreement.pk)
+        with self.assertNumQueries(1):
+            agreement.save()
+        agreement.name = 'Second Agreement'
+        agreement.save()
+        self.assertEqual(agreement.slug, 'second-agreement')
+
+
+class AgreementMixinTest(LastMileTestCase):
+
+    def test_agreement_is_resolved_once_per_request(self):
+        self.add_actions(1)
+        url = reverse('action-list', kwargs={
+            'agreement': self.agreement.slug})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'status': 'active'})
+        lookups = [query['sql'] for query in queries
+            if query['sql'].startswith(
+                'SELECT "lastmile_agreement"."id"')]
+        self.assertEqual(len(lookups), 2)
+
+
+class UserAgreementsCacheTest(LastMileTestCase):
+
+    def sidebar_names(self):
+        response = self.client.get(reverse('dashboard'))
+        return [agreement.name for agreement
+            in response.context['user_agreements']]
+
+    def test_sidebar_is_cached_and_invalidated(self):
+        self.assertEqual(self.sidebar_names(), ['Agreement'])
+        with CaptureQueriesContext(connection) as queries:
+            self.sidebar_names()
+        self.assertFalse([query for query in queries
+            if 'lastmile_agreement_users' in query['sql']
+            and 'lastmile_overview' in query['sql']])
+        self.agreement.name = 'Renamed'
+        self.agreement.save()
+        self.assertEqual(self.sidebar_names(), ['Renamed'])
+        other = Agreement.objects.create(name='Other')
+        self.user.agreement_set.add(other)
+        self.assertEqual(len(self.sidebar_names()), 2)
+        other.users.clear()
+        self.assertEqual(self.sidebar_names(), ['Renamed'])
+
+
+class MicrositeCacheTest(LastMileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.overview = Overview.objects.create(name='Overview',
+            agreement=self.agreement, methodology='First method',
+            hero_image='images/hero.png',
+            story_image='images/story.png',
+            commitments_image='images/commitments.png')
+        self.url = reverse('methodology', kwargs={
+            'agreement': self.agreement.slug, 'pk': self.overview.pk})
+
+    def test_page_is_cached_until_the_overview_changes(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'First method')
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.content, response.content)
+        self.assertFalse([query for query in queries
+            if 'lastmile_overview' in query['sql']])
+        self.overview.methodology = 'Second method'
+        self.overview.save()
+        self.assertContains(self.client.get(self.url), 'Second method')
+
+    def test_static_build_is_incremental(self):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+
+        def build():
+            stdout = StringIO()
+            call_command('build_microsite', output, stdout=stdout)
+            return stdout.getvalue()
+
+        self.assertIn('Rendered 8 of 8 pages', build())
+        path = os.path.join(output, 'mn', self.url.lstrip('/'),
+            'index.html')
+        with open(path) as page:
+            self.assertIn('/mn' + self.url, page.read())
+        self.assertIn('Rendered 0 of 8 pages', build())
+        Achievement.objects.create(name='Built',
+            overview=self.overview)
+        self.assertIn('Rendered 2 of 8 pages', build())
+
+    def test_pages_are_cached_per_agreement_slug(self):
+        self.client.get(self.url)
+        other = Agreement.objects.create(name='Other Agreement')
+        response = self.client.get(reverse('methodology', kwargs={
+            'agreement': other.slug, 'pk': self.overview.pk}))
+        self.assertContains(response, '/other-agreement/')
+        self.assertNotContains(response,
+            '/{}/'.format(self.agreement.slug))
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url,
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url,
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            .status_code, 304)
+        Overview.objects.filter(pk=self.overview.pk).update(
+            methodology='Unsaved method')
+        Document.objects.create(name='Report', overview=self.overview)
+        self.assertEqual(self.client.get(self.url,
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class DirectUploadTest(LastMileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_actions(1)
+        self.commitment = Commitment.objects.get()
+        use_test_storage(self,
+            Attachment._meta.get_field('file').storage)
+
+    def sign(self, size=4):
+        return self.client.post(reverse('attachment-upload', kwargs={
+            'agreement': self.agreement.slug}), {
+            'name': 'Report',
+            'commitment': self.commitment.pk,
+            'filename': 'report.pdf',
+            'content_type': 'application/pdf',
+            'size': size,
+        })
+
+    def complete(self, token):
+        return self.client.post(reverse('attachment-upload-complete',
+            kwargs={'agreement': self.agreement.slug}),
+            {'token': token})
+
+    def test_file_is_uploaded_straight_to_the_bucket(self):
+        policy = self.sign().json()
+        if policy['url'].startswith('/'):
+            upload = self.client.post(policy['url'], dict(
+                policy['fields'],
+                file=SimpleUploadedFile('report.pdf', b'%PDF')))
+        else:
+            upload = requests.post(policy['url'],
+                data=policy['fields'],
+                files={'file': ('report.pdf', b'%PDF')})
+        self.assertEqual(upload.status_code, 204)
+        for i in range(2):
+            response = self.complete(policy['token'])
+            self.assertEqual(response.json()['redirect'],
+                self.commitment.get_absolute_url())
+        attachment = Attachment.objects.get()
+        self.assertEqual(attachment.file.read(), b'%PDF')
+        self.assertEqual(attachment.uploaded_by, self.user)
+        self.assertTrue(Update.objects.filter(
+            commitment=self.commitment,
+            description='Attachment Added').exists())
+
+    def test_invalid_uploads_are_rejected(self):
+        self.assertEqual(self.sign(size=10 ** 12).status_code, 400)
+        policy = self.sign().json()
+        self.assertEqual(self.complete(policy['token']).status_code,
+            400)
+        self.assertEqual(self.complete('forged').status_code, 400)
+        self.assertFalse(Attachment.objects.exists())
+
+
+class RenditionTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        use_test_storage(self,
+            Overview._meta.get_field('hero_image').storage)
+
+    def upload(self, width, height):
+        content = BytesIO()
+        Image.new('RGB', (width, height)).save(content, 'PNG')
+        return SimpleUploadedFile('hero.png', content.getvalue())
+
+    def test_uploaded_images_get_renditions(self):
+        overview = Overview.objects.create(name='Overview',
+            hero_image=self.upload(1200, 600))
+        self.assertEqual(
+            list(Rendition.objects.values_list(
+                'width', 'content_type')),
+            [(480, 'image/webp'), (480, 'image/jpeg'),
+                (960, 'image/webp'), (960, 'image/jpeg'),
+                (1200, 'image/webp'), (1200, 'image/jpeg')])
+        rendition = Rendition.objects.get(width=960,
+            content_type='image/jpeg')
+        self.assertEqual(Image.open(rendition.file).size, (960, 480))
+        html = Template('{% load custom_tags %}'
+            '{% picture overview.hero_image id="hero" %}'
+            '{{ overview.hero_image|rendition:500 }}').render(
+            Context({'overview': overview}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('hero-480w.webp', html)
+        self.assertIn('id="hero"', html)
+        self.assertIn('hero-960w.jpg', html.split('</picture>')[1])
+
+
+    def test_replaced_renditions_are_deleted(self):
+        overview = Overview.objects.create(name='Overview',
+            hero_image=self.upload(600, 300))
+        storage = overview.hero_image.storage
+        first = overview.hero_image.name
+        files = list(Rendition.objects.values_list('file', flat=True))
+        self.assertEqual(len(files), 4)
+        create_renditions(overview.hero_image)
+        self.assertFalse(any(storage.exists(name) for name in files))
+        files = list(Rendition.objects.values_list('file', flat=True))
+        overview.hero_image = self.upload(300, 150)
+        overview.save()
+        self.assertFalse(Rendition.objects.filter(original=first)
+            .exists())
+        self.assertFalse(any(storage.exists(name) for name in files))
+        self.assertEqual(Rendition.objects.filter(
+            original=overview.hero_image.name).count(), 2)
+
+class SignedURLCacheTest(TestCase):
+
+    def test_signed_urls_are_reused_until_near_expiry(self):
+        cache.clear()
+        caches['local'].clear()
+        storage = PrivateMediaStorage()
+        stats = storage.url_cache_stats
+        hits, misses = stats['hits'], stats['misses']
+        with mock.patch.object(S3Boto3Storage, 'url',
+            side_effect=['signed-1', 'signed-2', 'signed-3']) as url:
+            self.assertEqual(storage.url('images/a.png'), 'signed-1')
+            self.assertEqual(storage.url('images/a.png'), 'signed-1')
+            self.assertEqual(storage.url('images/b.png'), 'signed-2')
+            # Another worker finds the signature in the shared cache
+            caches['local'].clear()
+            self.assertEqual(storage.url('images/a.png'), 'signed-1')
+            with self.settings(LASTMILE_SIGNED_URL_MARGIN=3600):
+                self.assertEqual(storage.url('images/a.png'),
+                    'signed-3')
+        self.assertEqual(url.call_count, 3)
+        self.assertEqual((stats['hits'] - hits,
+            stats['misses'] - misses), (2, 2))
+
+
+class LocalPrivateMediaStorageTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = self.settings(MEDIA_ROOT=media_root,
+            PRIVATE_FILE_STORAGE='django_lastmile.storage_backends'
+                '.LocalPrivateMediaStorage')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.storage = private_storage()
+
+    def test_signed_urls(self):
+        name = self.storage.save('files/report.pdf',
+            SimpleUploadedFile('report.pdf', b'%PDF'))
+        url = self.storage.url(name)
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+        self.assertEqual(self.client.get(
+            url.replace('report', 'other')).status_code, 404)
+        self.assertEqual(self.client.get(
+            self.storage.url(name, expire=-1)).status_code, 404)
+
+    def test_presigned_post(self):
+        policy = self.storage.get_presigned_post('files/a/report.pdf',
+            'application/pdf', 4, 60)
+
+        def upload(content):
+            return self.client.post(policy['url'], dict(
+                policy['fields'],
+                file=SimpleUploadedFile('report.pdf', content)))
+
+        self.assertEqual(upload(b'%PDF-1.4').status_code, 403)
+        self.assertEqual(upload(b'%PDF').status_code, 204)
+        self.assertEqual(upload(b'%PDF').status_code, 403)
+        with self.storage.open('files/a/report.pdf') as f:
+            self.assertEqual(f.read(), b'%PDF')
+
+
+class AttachmentDeduplicationTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='staff',
+            is_staff=True)
+        self.client.force_login(user)
+        agreement = Agreement.objects.create(name='Agreement')
+        self.commitments = [Commitment.objects.create(
+            name='Commitment {}'.format(i), agreement=agreement)
+            for i in range(2)]
+        self.storage = Attachment._meta.get_field('file').storage
+        use_test_storage(self, self.storage)
+
+    def attach(self, commitment, content):
+        self.client.post(commitment.get_absolute_url(), {
+            'name': 'Report',
+            'description': '',
+            'file': SimpleUploadedFile('report.pdf', content),
+        })
+        return Attachment.objects.latest('pk')
+
+    def test_same_content_is_stored_once(self):
+        # Uploads arrive hashed by the upload handlers
+        with mock.patch.object(BlobFieldFile, 'get_digest',
+            side_effect=AssertionError):
+            first = self.attach(self.commitments[0], b'%PDF')
+            second = self.attach(self.commitments[1], b'%PDF')
+            other = self.attach(self.commitments[1], b'%PDF-2')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.file.name, other.file.name)
+        self.assertEqual(Blob.objects.get(
+            name=first.file.name).ref_count, 2)
+        first.delete()
+        self.assertTrue(self.storage.exists(second.file.name))
+        second.delete()
+        self.assertFalse(Blob.objects.filter(
+            name=second.file.name).exists())
+        self.assertFalse(self.storage.exists(second.file.name))
+        self.assertTrue(self.storage.exists(other.file.name))
+
+
+    def test_reuploading_the_same_content_adds_no_reference(self):
+        attachment = self.attach(self.commitments[0], b'%PDF')
+        name = attachment.file.name
+        for i in range(2):
+            attachment.file.save('report.pdf', ContentFile(b'%PDF'))
+        self.assertEqual(attachment.file.name, name)
+        self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+        attachment.delete()
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertFalse(self.storage.exists(name))
+
+class SearchTest(LastMileTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.commitment = Commitment.objects.create(
+            name='Road maintenance', agreement=self.agreement,
+            description='Keep the access road graded')
+        self.action = Action.objects.create(name='Hire a grader',
+            description='For the road to the village',
+            commitment=self.commitment)
+        Commitment.objects.create(name='Road closure',
+            agreement=Agreement.objects.create(name='Other'))
+
+    def search(self, query):
+        response = self.client.get(reverse('search'),
+            {'q': query, 'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        return [(result['kind'], result['id'])
+            for result in response.json()['results']]
+
+    def test_results_are_ranked_and_scoped(self):
+        if connection.vendor == 'sqlite':
+            self.assertEqual(get_search_backend(connection), FTS5)
+        expected = [('commitment', self.commitment.pk),
+            ('action', self.action.pk)]
+        self.assertEqual(self.search('ROAD'), expected)
+        self.assertEqual(self.search('grad'), [
+            ('action', self.action.pk),
+            ('commitment', self.commitment.pk)])
+        self.assertEqual(self.search('road village'),
+            [('action', self.action.pk)])
+        self.assertEqual(self.search('closure'), [])
+        with mock.patch('lastmile.search.get_search_backend',
+            return_value=PYTHON):
+            self.assertEqual(self.search('road'), expected)
+        response = self.client.get(reverse('search'), {'q': 'road'})
+        self.assertContains(response, self.action.get_absolute_url())
+
+    def test_index_follows_bulk_writes(self):
+        Commitment.objects.filter(pk=self.commitment.pk).update(
+            status_description='Culverts replaced')
+        Update.objects.bulk_create([Update(
+            description='Culverts inspected',
+            commitment=self.commitment)])
+        self.assertEqual(sorted(kind for kind, pk
+            in self.search('culverts')), ['commitment', 'update'])
+        Action.objects.filter(pk=self.action.pk).delete()
+        self.assertEqual(self.search('village'), [])
+
+
+class AttachmentSearchTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='staff',
+            is_staff=True)
+        self.client.force_login(user)
+        agreement = Agreement.objects.create(name='Agreement')
+        agreement.users.add(user)
+        self.commitment = Commitment.objects.create(
+            name='Commitment', agreement=agreement)
+        use_test_storage(self, private_storage())
+
+    def search(self, query):
+        response = self.client.get(reverse('search'),
+            {'q': query, 'format': 'json'})
+        return [(result['kind'], result['id'])
+            for result in response.json()['results']]
+
+    def test_attachment_text_is_indexed(self):
+        attachment = Attachment.objects.create(name='Report',
+            commitment=self.commitment,
+            file=SimpleUploadedFile('report.pdf',
+                make_pdf('Tailings dam inspection')))
+        self.assertIn('Tailings dam', attachment.text)
+        self.assertEqual(self.search('tailings'),
+            [('attachment', attachment.pk)])
+        attachment.file = SimpleUploadedFile('notes.txt', b'Tailings')
+        attachment.save()
+        self.assertEqual(self.search('tailings'), [])
+
+    def test_large_files_are_left_to_the_command(self):
+        with self.settings(LASTMILE_SEARCH_EXTRACT_MAX_SIZE=100):
+            attachment = Attachment.objects.create(name='Report',
+                commitment=self.commitment,
+                file=SimpleUploadedFile('report.pdf',
+                    make_pdf('Tailings dam inspection')))
+        self.assertEqual(attachment.text, '')
+        self.assertEqual(self.search('tailings'), [])
+        call_command('rebuild_search_index', extract=True,
+            stdout=StringIO())
+        self.assertEqual(self.search('tailings'),
+            [('attachment', attachment.pk)])
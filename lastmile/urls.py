@@ -4,6 +4,9 @@ from . import views
 
 urlpatterns = [
     path('', views.Dashboard.as_view(), name='dashboard'),
+    path('search/', views.Search.as_view(), name='search'),
+    path('media/private/upload/', views.PrivateMediaUpload.as_view(), name='private-media-upload'),
+    path('media/private/<path:name>', views.PrivateMediaView.as_view(), name='private-media'),
     path('<agreement>/', include([
         path('', views.AgreementDetail.as_view(), name='agreement-detail'),
         path('category/', include([
@@ -20,6 +23,8 @@ urlpatterns = [
             path('', views.CommitmentList.as_view(), name='commitment-list'),
             path('add/',views.CommitmentCreate.as_view(), name='commitment-create'),
             path('export/', views.CommitmentExport.as_view(), name='commitment-export'),
+            path('bulk-update/', views.CommitmentBulkUpdate.as_view(), name='commitment-bulk-update'),
+            path('import/', views.CommitmentImport.as_view(), name='commitment-import'),
             path('<pk>/', include([
                 path('', views.CommitmentDetail.as_view(), name='commitment-detail'),
                 path('add-action/', views.CommitmentActionCreate.as_view(), name='commitment-action-create'),
@@ -31,6 +36,8 @@ urlpatterns = [
             path('',views.ActionList.as_view(), name='action-list'),
             path('add/',views.ActionCreate.as_view(), name='action-create'),
             path('export/',views.ActionExport.as_view(), name='action-export'),
+            path('bulk-update/', views.ActionBulkUpdate.as_view(), name='action-bulk-update'),
+            path('import/', views.ActionImport.as_view(), name='action-import'),
             path('<pk>/', include([
                 path('',views.ActionDetail.as_view(), name='action-detail'),
                 path('update/', views.ActionUpdate.as_view(), name='action-update'),
@@ -50,6 +57,8 @@ urlpatterns = [
         path('attachments/', include([
             path('',views.AttachmentList.as_view(), name='attachment-list'),
             path('add/', views.AttachmentCreate.as_view(), name='attachment-create'),
+            path('upload/', views.AttachmentUploadSign.as_view(), name='attachment-upload'),
+            path('upload/complete/', views.AttachmentUploadComplete.as_view(), name='attachment-upload-complete'),
             path('<pk>/', include([
                 path('', views.AttachmentDetail.as_view(), name='attachment-detail'),
                 path('update/', views.AttachmentUpdate.as_view(), name='attachment-update'),
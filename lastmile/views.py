@@ -1,25 +1,64 @@
+import base64
+import hashlib
+import io
+import json
+import posixpath
+import uuid
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.forms import ChoiceField, ModelMultipleChoiceField
+from django.forms import CheckboxSelectMultiple, modelform_factory
+from django.db.models import F, Prefetch, Q, Value
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, Http404, HttpResponse
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
 from django.shortcuts import render, redirect
 from django.views.generic import View, DetailView, ListView
-from django.views.generic.edit import CreateView, UpdateView
+from django.views.generic.edit import CreateView, FormView
+from django.views.generic.edit import UpdateView
 from django.views.generic.edit import DeleteView
 from django.urls import reverse, reverse_lazy
+from django.views.decorators.csrf import csrf_exempt
+from django_lastmile.storage_backends import LocalPrivateMediaStorage
+from django_lastmile.storage_backends import private_storage
     
-from .functions import get_export_response
+from .context_processors import get_user_agreements
+from .forms import CSVImportForm, DirectUploadForm
+from .functions import EXPORT_FORMATS, CSVImportError
+from .functions import get_export_response, get_microsite_modified
+from .functions import import_csv, touch_agreement_microsites
 from .models import Action, Actor, Agreement, Attachment
 from .models import Commitment, CommitmentCategory, Update
 from .models import Overview, Achievement, Challenge
 from .models import Recommendation, Document
+from .search import search
+
+# Salt of the tokens that complete a direct attachment upload
+UPLOAD_SALT = 'lastmile.attachment-upload'
 
 class ExportMixin():
 
     def get(self, request, **kwargs):
-        resp = super().get(request, **kwargs)
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise Http404('Unknown export format')
         response = get_export_response(
             self.model, 
-            self.get_queryset())
+            self.get_queryset(),
+            export_format)
         return response
 
 class StaffMixin(UserPassesTestMixin):
@@ -35,16 +74,25 @@ class AgreementMixin(StaffMixin):
     login_url = '/login/'
 
     def get_agreement(self):
+        # Resolved once per request, as the view instance is
+        if not hasattr(self, '_agreement'):
+            self._agreement = self.find_agreement()
+        return self._agreement
+
+    def find_agreement(self):
         if self.kwargs.get('agreement'):
             try:
-                agreement = Agreement.objects.get(
+                agreement = Agreement.objects.select_related(
+                    'overview').get(
                     slug=self.kwargs.get('agreement'))
                 return agreement
             except Agreement.DoesNotExist:
                 return None
         else:
-            return Agreement.objects.filter(
-                users=self.request.user)[0]
+            return self.get_user_agreements()[0]
+
+    def get_user_agreements(self):
+        return get_user_agreements(self.request.user)
 
     # def test_func(self):
     #     user = self.request.user
@@ -77,24 +125,180 @@ class AttachmentMixin():
         return redirect(value.get_absolute_url())
 
 class FilterMixin():
+    # Query parameters that are not model field lookups
+    reserved_params = ('after', 'before', 'page_size', 'format')
 
     def get_queryset(self):
         queryset = super().get_queryset()
         filter_dict = {}
         for key, value in self.request.GET.items():
-            if value == 'overdue':
+            if key in self.reserved_params:
+                continue
+            elif value == 'overdue':
                 queryset = self.get_overdue_items(queryset)
             else:
                 filter_dict[key] = value
         return queryset.filter(**filter_dict)
 
     def get_overdue_items(self, queryset):
-        overdue = []
-        for item in queryset:
-            if item.get_status() == 'overdue':
-                overdue.append(item.id)
-        return queryset.filter(id__in=overdue)
+        return queryset.overdue()
     
+class KeysetPage():
+    """Stands in for a Paginator page when paginating by cursor.
+    """
+
+    def __init__(self, object_list, queryset, next_cursor,
+        previous_cursor):
+        self.object_list = object_list
+        self.queryset = queryset
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @cached_property
+    def count(self):
+        return self.queryset.count()
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+class KeysetPaginationMixin():
+    """Paginates a ListView by seeking past the last row of the
+    previous page on (keyset_ordering..., id) instead of using
+    OFFSET, so every page costs the same to fetch.
+    """
+    paginate_by = settings.LASTMILE_PAGE_SIZE
+    max_paginate_by = settings.LASTMILE_MAX_PAGE_SIZE
+    # Field names or non-null expressions, all ascending
+    keyset_ordering = ()
+
+    def get_paginate_by(self, queryset):
+        if self.paginate_by is None:
+            return None
+        try:
+            page_size = int(self.request.GET.get(
+                'page_size', self.paginate_by))
+        except ValueError:
+            page_size = self.paginate_by
+        return max(1, min(page_size, self.max_paginate_by))
+
+    def get_keyset(self):
+        keyset = {}
+        for i, key in enumerate(self.keyset_ordering):
+            if isinstance(key, str):
+                key = F(key)
+            keyset['keyset_{}'.format(i)] = key
+        keyset['keyset_id'] = F('id')
+        return keyset
+
+    def encode_cursor(self, obj, keys):
+        values = [getattr(obj, key) for key in keys]
+        data = json.dumps(values, cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(
+            data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor, keys):
+        try:
+            data = base64.urlsafe_b64decode(
+                cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(data)
+        except ValueError:
+            raise Http404('Invalid page cursor')
+        if not isinstance(values, list) or \
+            len(values) != len(keys) or not all(
+            isinstance(value, (str, int, float)) for value in values):
+            raise Http404('Invalid page cursor')
+        return values
+
+    def get_seek_filter(self, keys, values, reverse):
+        lookup = 'lt' if reverse else 'gt'
+        seek = Q()
+        for i, key in enumerate(keys):
+            step = Q(**{'{}__{}'.format(key, lookup): values[i]})
+            for prior, value in zip(keys[:i], values[:i]):
+                step &= Q(**{prior: value})
+            seek |= step
+        return seek
+
+    def paginate_queryset(self, queryset, page_size):
+        keyset = self.get_keyset()
+        keys = list(keyset)
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+        reverse = bool(before) and not after
+        rows = queryset.annotate(**keyset)
+        if after or before:
+            values = self.decode_cursor(after or before, keys)
+            try:
+                rows = rows.filter(
+                    self.get_seek_filter(keys, values, reverse))
+            except (TypeError, ValueError, ValidationError):
+                # Values of the wrong type for their keys
+                raise Http404('Invalid page cursor')
+        rows = list(rows.order_by(
+            *['-' + key if reverse else key for key in keys])
+            [:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        next_cursor = previous_cursor = None
+        if rows and (has_more or reverse):
+            next_cursor = self.encode_cursor(rows[-1], keys)
+        if rows and (has_more if reverse else bool(after)):
+            previous_cursor = self.encode_cursor(rows[0], keys)
+        page = KeysetPage(rows, queryset, next_cursor,
+            previous_cursor)
+        return (None, page, rows, page.has_other_pages())
+
+
+class MicrositeCacheMixin():
+    """Serves the rendered page of an overview's microsite from the
+    cache until lastmile.signals marks it modified, and answers
+    conditional GETs with the cached ETag and Last-Modified.
+    """
+
+    def get(self, request, *args, **kwargs):
+        modified = get_microsite_modified(self.kwargs.get('pk'))
+        key = self.get_cache_key(modified)
+        cached = cache.get(key)
+        if cached is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.render()
+            cached = (response.content, response['Content-Type'],
+                quote_etag(hashlib.md5(response.content).hexdigest()))
+            cache.set(key, cached,
+                settings.LASTMILE_MICROSITE_CACHE_TIMEOUT)
+        content, content_type, etag = cached
+        response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return get_conditional_response(request, etag=etag,
+            last_modified=int(modified), response=response)
+
+    def get_cache_key(self, modified):
+        # Pages link to their agreement by slug
+        variant = '{0}?{1}'.format(self.kwargs.get('agreement'),
+            self.request.GET.urlencode())
+        return 'lastmile:microsite:{0}:{1}:{2}:{3}:{4}'.format(
+            self.kwargs.get('pk'), modified, get_language(),
+            self.__class__.__name__,
+            hashlib.md5(variant.encode()).hexdigest())
+
 class BaseView(LoginRequiredMixin, View):
     login_url = '/login/'
 
@@ -110,6 +314,78 @@ class DeleteView(StaffMixin, DeleteView):
         messages.success(request, 'Succesfully Deleted')
         return super().delete(request, *args, **kwargs)
 
+class BulkUpdateView(FormView):
+    """Applies the same field values to many selected rows through
+    Model.bulk_apply_changes, so the edit is one UPDATE and its
+    revisions one INSERT. Blank fields are left unchanged.
+    """
+    bulk_fields = ('status', 'status_description',
+        'expected_completion_date', 'completion_date')
+    template_name = 'lastmile/bulk_update_form.html'
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    def get_form_class(self):
+        form_class = modelform_factory(
+            self.model, fields=self.bulk_fields)
+        for name, field in form_class.base_fields.items():
+            field.required = False
+            model_field = self.model._meta.get_field(name)
+            if model_field.choices:
+                # A blank first choice, so the status can be kept
+                form_class.base_fields[name] = ChoiceField(
+                    choices=model_field.get_choices(
+                        include_blank=True),
+                    required=False, label=field.label, initial='')
+        form_class.base_fields['objects'] = \
+            ModelMultipleChoiceField(
+                queryset=self.model._default_manager.none(),
+                widget=CheckboxSelectMultiple,
+                label=self.model._meta.verbose_name_plural.title())
+        return form_class
+
+    def get_initial(self):
+        # Not the model defaults, which would overwrite every row
+        return dict.fromkeys(self.bulk_fields, '')
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        form.fields['objects'].queryset = self.get_queryset()
+        return form
+
+    def form_valid(self, form):
+        changes = {}
+        for name in self.bulk_fields:
+            if form.cleaned_data.get(name) not in (None, ''):
+                changes[name] = form.cleaned_data[name]
+        count = self.model.bulk_apply_changes(
+            form.cleaned_data['objects'], **changes)
+        touch_agreement_microsites(self.get_agreement().pk)
+        messages.success(self.request, '{0} {1} Updated'.format(
+            count, self.model._meta.verbose_name_plural.title()))
+        return super().form_valid(form)
+
+class CSVImportView(FormView):
+    form_class = CSVImportForm
+    template_name = 'lastmile/import_form.html'
+
+    def form_valid(self, form):
+        lines = io.TextIOWrapper(form.cleaned_data['file'].file,
+            encoding='utf-8-sig', newline='')
+        try:
+            created = import_csv(self.model, self.get_agreement(),
+                lines, dry_run=form.cleaned_data['dry_run'])
+        except (CSVImportError, UnicodeDecodeError) as error:
+            for message in getattr(error, 'errors', [str(error)]):
+                form.add_error('file', message)
+            return self.form_invalid(form)
+        messages.success(self.request, '{0}{1} {2} Imported'.format(
+            'Dry run: ' if form.cleaned_data['dry_run'] else '',
+            created,
+            self.model._meta.verbose_name_plural.title()))
+        return super().form_valid(form)
+
 class AgreementView(BaseAgreementView):
     model = Agreement
     fields = ['name', 'users']
@@ -124,11 +400,14 @@ class AgreementDetail(AgreementView, DetailView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        obj = self.get_object()
+        obj = self.object
         context['chart_data'] = {
             'commitment': obj.get_commitment_dict(),
             'action': obj.get_action_dict()
         }
+        context['actor_list'] = Actor.objects.filter(
+            agreement=obj).select_related('user') \
+            .with_workload(agreement=obj)
         return context   
 
 class AgreementCreate(AgreementView, CreateView):
@@ -151,9 +430,9 @@ class CommitmentCategoryView(BaseAgreementView):
         form.instance.agreement = self.get_agreement()
         return super().form_valid(form)
 
-class CommitmentCategoryList(
+class CommitmentCategoryList(KeysetPaginationMixin,
     CommitmentCategoryView, ListView):
-    pass
+    keyset_ordering = ('order_num',)
 
 class CommitmentCategoryDetail(
     CommitmentCategoryView, DetailView):
@@ -193,12 +472,39 @@ class CommitmentView(BaseAgreementView):
         form.instance.agreement = self.get_agreement()
         return super().form_valid(form)
 
-class CommitmentList(CommitmentView, ListView):
-    pass
+class CommitmentList(KeysetPaginationMixin, CommitmentView,
+    ListView):
+    # Uncategorized commitments after the categorized ones, where
+    #  the category ordering put them on PostgreSQL
+    keyset_ordering = (
+        Coalesce('category__order_num', Value(32768)), 'order_num')
+
+    def get_queryset(self):
+        queryset = super(CommitmentList, self).get_queryset()
+        return queryset.select_related(
+            'agreement', 'category__agreement').prefetch_related(
+                Prefetch('action_set',
+                    queryset=Action.objects.order_by('status')))
 
 class CommitmentExport(ExportMixin, CommitmentList):
     pass
         
+class CommitmentBulkUpdate(CommitmentView, BulkUpdateView):
+
+    def get_success_url(self):
+        return reverse('commitment-list', kwargs={
+            'agreement': self.kwargs.get('agreement')})
+
+class CommitmentImport(CommitmentView, CSVImportView):
+
+    def form_valid(self, form):
+        # CommitmentView.form_valid expects a model form
+        return CSVImportView.form_valid(self, form)
+
+    def get_success_url(self):
+        return reverse('commitment-list', kwargs={
+            'agreement': self.kwargs.get('agreement')})
+
 class CommitmentDetail(
     AttachmentMixin, CommitmentView, DetailView):
     pass
@@ -229,6 +535,13 @@ class CommitmentDelete(CommitmentView, DeleteView):
 
 class Dashboard(CommitmentList):
     template_name = 'lastmile/dashboard.html'
+    paginate_by = None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['agreement_list'] = Agreement.objects.filter(
+            users=self.request.user).with_dashboard_stats()
+        return context
 
 class ActionView(BaseAgreementView):
     model = Action
@@ -244,20 +557,19 @@ class ActionView(BaseAgreementView):
         return queryset.filter(
             commitment__agreement__in=agreements).distinct()
 
-class ActionList(ActionView, ListView):
+class ActionList(KeysetPaginationMixin, ActionView, ListView):
     
     def get_queryset(self):
-        queryset = super(ActionList, self).get_queryset()
+        queryset = super(ActionList, self).get_queryset() \
+            .select_related('commitment__agreement') \
+            .prefetch_related(Prefetch('responsible_parties',
+                queryset=Actor.objects.select_related('user')))
         if self.get_agreement():
             queryset = queryset.filter(
                 commitment__agreement=self.get_agreement())
         if self.kwargs.get('status'):
             if self.kwargs.get('status') == 'overdue':
-                agreement = self.get_agreement()
-                actions = agreement.get_overdue_actions()
-                action_ids = actions.values_list(
-                    'id', flat=True)
-                queryset = queryset.filter(id__in=action_ids)
+                queryset = queryset.overdue()
             else:
                 queryset = queryset.filter(
                     status=self.kwargs.get('status'))
@@ -266,6 +578,23 @@ class ActionList(ActionView, ListView):
 class ActionExport(ExportMixin, ActionList):
     pass
 
+class ActionBulkUpdate(ActionView, BulkUpdateView):
+
+    def get_queryset(self):
+        queryset = super(ActionBulkUpdate, self).get_queryset()
+        return queryset.filter(
+            commitment__agreement=self.get_agreement())
+
+    def get_success_url(self):
+        return reverse('action-list', kwargs={
+            'agreement': self.kwargs.get('agreement')})
+
+class ActionImport(ActionView, CSVImportView):
+
+    def get_success_url(self):
+        return reverse('action-list', kwargs={
+            'agreement': self.kwargs.get('agreement')})
+
 class ActionDetail(ActionView, DetailView, AttachmentMixin):
     pass
 
@@ -317,7 +646,7 @@ class ActorView(BaseAgreementView):
             Agreement.objects.filter(users=self.request.user)
         return form
 
-class ActorList(ActorView, ListView):
+class ActorList(KeysetPaginationMixin, ActorView, ListView):
     
     def get_queryset(self):
         queryset = super(ActorList, self).get_queryset()
@@ -365,7 +694,8 @@ class AttachmentView(BaseAgreementView):
         else:
             return reverse('dashboard')
 
-class AttachmentList(AttachmentView, ListView):
+class AttachmentList(KeysetPaginationMixin, AttachmentView,
+    ListView):
     pass
 
 class AttachmentDetail(AttachmentView, DetailView):
@@ -383,6 +713,131 @@ class AttachmentUpdate(AttachmentView, UpdateView):
 class AttachmentDelete(AttachmentView, DeleteView):
     pass
 
+class AttachmentUploadSign(AgreementMixin, View):
+    """Issues a signed policy for uploading an attachment's file
+    straight to the bucket, with a token to complete it once the
+    upload is done.
+    """
+
+    def post(self, request, **kwargs):
+        form = DirectUploadForm(request.POST,
+            agreement=self.get_agreement())
+        if not form.is_valid():
+            return JsonResponse({
+                'errors': form.errors.get_json_data()}, status=400)
+        data = form.cleaned_data
+        field = Attachment._meta.get_field('file')
+        # A fresh directory per upload keeps the key unique without
+        #  asking the bucket whether the name is taken
+        name = field.generate_filename(None, posixpath.join(
+            uuid.uuid4().hex, data['filename']))
+        response = field.storage.get_presigned_post(name,
+            data['content_type'] or 'application/octet-stream',
+            settings.LASTMILE_UPLOAD_MAX_SIZE,
+            settings.LASTMILE_UPLOAD_EXPIRES)
+        response['token'] = signing.dumps({
+            'file': name,
+            'name': data['name'],
+            'description': data['description'],
+            'commitment': getattr(data['commitment'], 'pk', None),
+            'action': getattr(data['action'], 'pk', None),
+            'user': request.user.pk,
+        }, salt=UPLOAD_SALT)
+        return JsonResponse(response)
+
+class AttachmentUploadComplete(AgreementMixin, View):
+    """Creates the Attachment, and its Update, for a file uploaded
+    with a policy from AttachmentUploadSign.
+    """
+
+    def post(self, request, **kwargs):
+        try:
+            # The upload may start just before the policy expires
+            data = signing.loads(request.POST.get('token', ''),
+                salt=UPLOAD_SALT,
+                max_age=settings.LASTMILE_UPLOAD_EXPIRES * 2)
+        except signing.BadSignature:
+            data = None
+        if not data or data['user'] != request.user.pk:
+            return self.error('Invalid or expired upload')
+        attachment = Attachment.objects.filter(
+            file=data['file']).first()
+        if attachment is None:
+            field = Attachment._meta.get_field('file')
+            if not field.storage.exists(data['file']):
+                return self.error('The file was not uploaded')
+            attachment = Attachment(
+                name=data['name'],
+                file=data['file'],
+                description=data['description'],
+                commitment_id=data['commitment'],
+                action_id=data['action'],
+                uploaded_by=request.user,
+            )
+            attachment.save()
+            messages.success(request, 'Attachment Added')
+        target = attachment.action or attachment.commitment
+        return JsonResponse({'redirect': target.get_absolute_url()})
+
+    def error(self, message):
+        return JsonResponse({'errors': {'__all__': [
+            {'message': message, 'code': 'invalid'}]}}, status=400)
+
+class Search(AgreementMixin, BaseView, ListView):
+    """Ranked full-text search of the user's agreements, as a page
+    or, with format=json, as JSON.
+    """
+    template_name = 'lastmile/search.html'
+    context_object_name = 'results'
+
+    def get(self, request, **kwargs):
+        if request.GET.get('format') == 'json':
+            return JsonResponse({'results': [{
+                'kind': result.kind,
+                'id': result.object.pk,
+                'title': result.title,
+                'snippet': result.snippet,
+                'url': result.url,
+                'rank': result.rank,
+            } for result in self.get_queryset()]})
+        return super().get(request, **kwargs)
+
+    def get_queryset(self):
+        return search(self.request.GET.get('q', ''), [
+            agreement.pk for agreement in self.get_user_agreements()])
+
+class PrivateMediaView(View):
+    """Serves a file of LocalPrivateMediaStorage to holders of a URL
+    it signed, as the bucket does for PrivateMediaStorage.
+    """
+
+    def get(self, request, name):
+        storage = private_storage()
+        if not isinstance(storage, LocalPrivateMediaStorage) or \
+            not storage.check_signature(
+                name, request.GET.get('signature', '')) or \
+            not storage.exists(name):
+            raise Http404
+        return FileResponse(storage.open(name))
+
+@method_decorator(csrf_exempt, name='dispatch')
+class PrivateMediaUpload(View):
+    """Accepts a browser upload to LocalPrivateMediaStorage under a
+    policy from its get_presigned_post.
+    """
+
+    def post(self, request):
+        storage = private_storage()
+        upload = request.FILES.get('file')
+        if not isinstance(storage, LocalPrivateMediaStorage) or \
+            upload is None:
+            raise Http404
+        name = storage.check_policy(request.POST, upload)
+        if name is None:
+            return HttpResponse(status=403)
+        storage.save(name, upload)
+        return HttpResponse(status=204)
+
 class OverviewView(BaseAgreementView):
     model = Overview
     fields = ['name', 'subtitle', 'hero_video', 'hero_image',
@@ -394,7 +849,8 @@ class OverviewView(BaseAgreementView):
         'bg_color', 'bg_color_2', 'bg_color_3'
     ]
 
-class OverviewDetail(OverviewView, DetailView):
+class OverviewDetail(MicrositeCacheMixin, OverviewView,
+    DetailView):
     template_name = 'microsite/home.html'
 
     def get_context_data(self, **kwargs):
@@ -441,11 +897,13 @@ class OverviewDetail(OverviewView, DetailView):
                     value['status_count']
         return chart_dict
 
-class Methodology(OverviewView, DetailView):
+class Methodology(MicrositeCacheMixin, OverviewView,
+    DetailView):
     template_name = 'microsite/methodology.html'
 
-class MicrositeCommitmentList(CommitmentList):
+class MicrositeCommitmentList(MicrositeCacheMixin, CommitmentList):
     template_name = 'microsite/commitment_list.html'
+    paginate_by = None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -455,7 +913,8 @@ class MicrositeCommitmentList(CommitmentList):
         })
         return context
 
-class MicrositeDocumentList(BaseAgreementView, ListView):
+class MicrositeDocumentList(MicrositeCacheMixin, BaseAgreementView,
+    ListView):
     model = Document
     template_name = 'microsite/document_list.html'
 
@@ -0,0 +1,40 @@
+// Uploads the file of a form with data-upload-url straight to the
+// bucket using a signed policy, then completes the attachment at
+// data-complete-url. Any failure falls back to posting the form,
+// file included, through the app as before.
+$(document).on('submit', 'form[data-upload-url]', function(event) {
+  var form = this;
+  var input = $(form).find('input[type=file]')[0];
+  var file = input && input.files[0];
+  if (!file || !window.FormData) {
+    return;
+  }
+  event.preventDefault();
+  var data = new FormData(form);
+  data.delete(input.name);
+  data.append('filename', file.name);
+  data.append('content_type', file.type);
+  data.append('size', file.size);
+  var post = function(url, body) {
+    return $.ajax({url: url, method: 'POST', data: body,
+      processData: false, contentType: false});
+  };
+  post(form.dataset.uploadUrl, data).then(function(policy) {
+    var upload = new FormData();
+    $.each(policy.fields, function(key, value) {
+      upload.append(key, value);
+    });
+    upload.append('file', file);
+    return post(policy.url, upload).then(function() {
+      var complete = new FormData();
+      complete.append('token', policy.token);
+      complete.append('csrfmiddlewaretoken',
+        data.get('csrfmiddlewaretoken'));
+      return post(form.dataset.completeUrl, complete);
+    });
+  }).then(function(result) {
+    window.location = result.redirect;
+  }, function() {
+    form.submit();
+  });
+});